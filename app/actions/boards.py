@@ -0,0 +1,54 @@
+from app.dependency import boards_collection
+from app.actions.pagination import decode_cursor, encode_cursor, keyset_filter
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+BOARD_PREVIEW_COUNT = int(os.getenv("BOARD_PREVIEW_COUNT", "1"))
+
+
+async def list_user_boards(user_id: str, page_size: int | None = None, cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """
+    The user's boards in creation order, each with `post_count` and the file paths of
+    its first BOARD_PREVIEW_COUNT posts as `preview_images`.
+
+    One aggregation for the whole page: the preview posts are joined with a $lookup on
+    _id, so the cost does not grow with the number of boards. Without `page_size` every
+    board is returned. Returns (boards, next_cursor).
+    """
+    match = {"user_id": user_id}
+    if cursor:
+        match.update(keyset_filter(["_id"], decode_cursor(cursor), descending=False))
+    pipeline = [{"$match": match}, {"$sort": {"_id": 1}}]
+    if page_size:
+        pipeline.append({"$limit": page_size + 1})
+    pipeline += [
+        {"$addFields": {
+            "post_count": {"$size": {"$ifNull": ["$posts", []]}},
+            "preview_ids": {"$slice": [{"$ifNull": ["$posts", []]}, BOARD_PREVIEW_COUNT]},
+        }},
+        {"$lookup": {
+            "from": "posts",
+            "localField": "preview_ids",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {
+                "path": {"$ifNull": ["$file_details.medium.file_path", "$file_details.high.file_path"]}
+            }}],
+            "as": "preview_posts",
+        }},
+    ]
+    boards = await (await boards_collection.aggregate(pipeline)).to_list(length=None)
+
+    next_cursor = None
+    if page_size and len(boards) > page_size:
+        boards = boards[:page_size]
+        next_cursor = encode_cursor([boards[-1]["_id"]])
+
+    for board in boards:
+        # $lookup does not keep the order of preview_ids
+        paths = {post["_id"]: post.get("path") for post in board.pop("preview_posts")}
+        board["preview_images"] = [paths[post_id] for post_id in board.pop("preview_ids") if paths.get(post_id)]
+        board["posts"] = [str(post_id) for post_id in board.get("posts", [])]
+        board["_id"] = str(board["_id"])
+    return boards, next_cursor
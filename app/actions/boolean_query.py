@@ -0,0 +1,164 @@
+"""Boolean tag queries: cat AND sofa -dog, "ice cream" OR gelato, NOT (dog OR cat).
+
+Grammar (AND binds tighter than OR; adjacent terms are ANDed):
+
+    expr    := and_expr ("OR" and_expr)*
+    and_expr:= unary (["AND"] unary)*
+    unary   := ("NOT" | "-") unary | primary
+    primary := word | "quoted phrase" | "(" expr ")"
+
+Parsed queries are tuples: ("tag", name), ("and", [nodes]), ("or", [nodes]), ("not", node).
+"""
+import re
+
+KEYWORDS = {"AND", "OR", "NOT"}
+
+_TOKEN_RE = re.compile(r'"([^"]*)"|(\()|(\))|(-)(?=[^\s)])|([^\s()"]+)')
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+def looks_boolean(query: str) -> bool:
+    """Whether a /search query uses the boolean syntax rather than plain free text."""
+    return bool(re.search(r'"|\(|\)|(^|\s)-\S|\b(AND|OR|NOT)\b', query))
+
+
+def _tokenize(query: str) -> list[tuple[str, str]]:
+    tokens = []
+    for phrase, open_, close, minus, word in _TOKEN_RE.findall(query):
+        if open_:
+            tokens.append(("(", open_))
+        elif close:
+            tokens.append((")", close))
+        elif minus:
+            tokens.append(("NOT", minus))
+        elif word == "-":
+            raise QuerySyntaxError("A lone '-' is not a tag; write -tag to exclude a tag")
+        elif word in KEYWORDS:
+            tokens.append((word, word))
+        elif word:
+            tokens.append(("TERM", word.lower()))
+        elif phrase.strip():
+            tokens.append(("TERM", " ".join(phrase.lower().split())))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expr(self):
+        nodes = [self.and_expr()]
+        while self.peek() == "OR":
+            self.take()
+            nodes.append(self.and_expr())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def and_expr(self):
+        nodes = [self.unary()]
+        while self.peek() in ("AND", "NOT", "TERM", "("):
+            if self.peek() == "AND":
+                self.take()
+            nodes.append(self.unary())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def unary(self):
+        if self.peek() == "NOT":
+            self.take()
+            return ("not", self.unary())
+        return self.primary()
+
+    def primary(self):
+        kind = self.peek()
+        if kind == "TERM":
+            return ("tag", self.take()[1])
+        if kind == "(":
+            self.take()
+            node = self.expr()
+            if self.peek() != ")":
+                raise QuerySyntaxError("Missing closing parenthesis")
+            self.take()
+            return node
+        raise QuerySyntaxError(f"Expected a tag, got {self.tokens[self.position][1]!r}" if kind else "Unexpected end of query")
+
+
+def parse_query(query: str):
+    tokens = _tokenize(query)
+    if not tokens:
+        raise QuerySyntaxError("Empty query")
+    parser = _Parser(tokens)
+    node = parser.expr()
+    if parser.peek() is not None:
+        raise QuerySyntaxError(f"Unexpected {parser.tokens[parser.position][1]!r}")
+    return node
+
+
+def query_tags(node) -> set[str]:
+    """Every tag name the query mentions."""
+    if node[0] == "tag":
+        return {node[1]}
+    if node[0] == "not":
+        return query_tags(node[1])
+    return set().union(*(query_tags(child) for child in node[1]))
+
+
+def expand_case(node, names_by_lower: dict[str, set[str]]):
+    """Replace each (lowercased) term with the user's actual tag names that match it case-insensitively.
+
+    Gives MongoDB filters the same matching as the in-memory post index; a term
+    with no matching tag is kept as is (and matches nothing).
+    """
+    kind = node[0]
+    if kind == "tag":
+        names = sorted(names_by_lower.get(node[1], ()))
+        if not names:
+            return node
+        return ("tag", names[0]) if len(names) == 1 else ("or", [("tag", name) for name in names])
+    if kind == "not":
+        return ("not", expand_case(node[1], names_by_lower))
+    return (kind, [expand_case(child, names_by_lower) for child in node[1]])
+
+
+def to_mongo_filter(node) -> dict:
+    """Compile a parsed query to a filter on posts.tag_names.
+
+    Plain tag lists collapse into $all / $in / $nin so the multikey index on
+    tag_names can serve them; only mixed sub-expressions need $and/$or/$nor.
+    """
+    kind = node[0]
+    if kind == "tag":
+        return {"tag_names": node[1]}
+    if kind == "not":
+        inner = node[1]
+        if inner[0] == "tag":
+            return {"tag_names": {"$ne": inner[1]}}
+        if inner[0] == "or" and all(child[0] == "tag" for child in inner[1]):
+            return {"tag_names": {"$nin": [child[1] for child in inner[1]]}}
+        return {"$nor": [to_mongo_filter(inner)]}
+    children = node[1]
+    if kind == "or":
+        if all(child[0] == "tag" for child in children):
+            return {"tag_names": {"$in": [child[1] for child in children]}}
+        return {"$or": [to_mongo_filter(child) for child in children]}
+
+    required = [child[1] for child in children if child[0] == "tag"]
+    excluded = [child[1][1] for child in children if child[0] == "not" and child[1][0] == "tag"]
+    rest = [child for child in children if child[0] != "tag" and not (child[0] == "not" and child[1][0] == "tag")]
+    clauses = []
+    if required:
+        clauses.append({"tag_names": {"$all": required}} if len(required) > 1 else {"tag_names": required[0]})
+    if excluded:
+        clauses.append({"tag_names": {"$nin": excluded}})
+    clauses += [to_mongo_filter(child) for child in rest]
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
@@ -0,0 +1,231 @@
+from fastembed import TextEmbedding
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from app.dependency import embedding_cache_collection
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+from typing import List
+import numpy as np
+import asyncio, os, time
+
+load_dotenv()
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "BAAI/bge-small-en-v1.5")
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "64"))
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "2"))
+EMBEDDING_CACHE_ENTRIES = int(os.getenv("EMBEDDING_CACHE_ENTRIES", "20000"))
+EMBEDDING_CACHE_PERSIST = os.getenv("EMBEDDING_CACHE_PERSIST", "1") == "1"
+
+
+class EmbeddingEngine:
+    """Micro-batching front end for the fastembed model.
+
+    Concurrent `embed` calls are collected for up to `window_ms` (or until
+    `max_batch` texts are waiting) and run through the ONNX model as one
+    batch on a small thread pool, then the vectors are handed back to each
+    caller in order.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, max_batch: int = EMBEDDING_MAX_BATCH,
+                 window_ms: float = EMBEDDING_BATCH_WINDOW_MS, threads: int = EMBEDDING_THREADS):
+        self.model_name = model_name
+        self.model = TextEmbedding(model_name=model_name)
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="embed")
+        self._pending: deque = deque()  # (texts, future, enqueued_at)
+        self._pending_texts = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self.counters = {
+            "requests": 0, "texts": 0, "batches": 0, "errors": 0,
+            "batch_ms_total": 0.0, "batch_ms_max": 0.0,
+            "queue_wait_ms_total": 0.0, "queue_wait_ms_max": 0.0,
+        }
+
+    async def embed(self, texts: List[str]) -> list:
+        """Embed texts, sharing a model batch with any other concurrent callers."""
+        texts = list(texts)
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((texts, future, time.perf_counter()))
+        self._pending_texts += len(texts)
+        self.counters["requests"] += 1
+
+        if self._pending_texts >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, size = [], 0
+            # A single oversized request still goes out as its own batch
+            while self._pending and (not batch or size + len(self._pending[0][0]) <= self.max_batch):
+                item = self._pending.popleft()
+                batch.append(item)
+                size += len(item[0])
+            self._pending_texts -= size
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: list):
+        texts = [text for item_texts, _, _ in batch for text in item_texts]
+        started = time.perf_counter()
+        for _, _, enqueued_at in batch:
+            wait_ms = (started - enqueued_at) * 1000
+            self.counters["queue_wait_ms_total"] += wait_ms
+            self.counters["queue_wait_ms_max"] = max(self.counters["queue_wait_ms_max"], wait_ms)
+
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                lambda: list(self.model.embed(texts, batch_size=len(texts)))
+            )
+        except Exception as e:
+            self.counters["errors"] += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.counters["batches"] += 1
+        self.counters["texts"] += len(texts)
+        self.counters["batch_ms_total"] += elapsed_ms
+        self.counters["batch_ms_max"] = max(self.counters["batch_ms_max"], elapsed_ms)
+
+        offset = 0
+        for item_texts, future, _ in batch:
+            if not future.done():
+                future.set_result(vectors[offset:offset + len(item_texts)])
+            offset += len(item_texts)
+
+    def stats(self) -> dict:
+        batches, requests = self.counters["batches"], self.counters["requests"]
+        return {
+            **{k: round(v, 2) if isinstance(v, float) else v for k, v in self.counters.items()},
+            "avg_batch_size": round(self.counters["texts"] / batches, 2) if batches else 0.0,
+            "avg_batch_ms": round(self.counters["batch_ms_total"] / batches, 2) if batches else 0.0,
+            "avg_queue_wait_ms": round(self.counters["queue_wait_ms_total"] / requests, 2) if requests else 0.0,
+            "pending_texts": self._pending_texts,
+        }
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used as the cache key (and embedded), so "Cake " and "cake" share a vector."""
+    return " ".join(text.split()).lower()
+
+
+class EmbeddingCache:
+    """Bounded LRU of embeddings keyed on (model, normalized text).
+
+    When a collection is given (EMBEDDING_CACHE_PERSIST), memory misses fall
+    through to `embedding_cache` so a restarted process does not recompute
+    vectors it has already paid for.
+    """
+
+    def __init__(self, model_name: str, collection=None, max_entries: int = EMBEDDING_CACHE_ENTRIES):
+        self.model_name = model_name
+        self.collection = collection
+        self.max_entries = max_entries
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.counters = {"memory_hits": 0, "persistent_hits": 0, "misses": 0}
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_name}:{text}"
+
+    def _remember(self, text: str, vector: np.ndarray):
+        self._memory[text] = vector
+        self._memory.move_to_end(text)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get_many(self, texts: list[str]) -> dict[str, np.ndarray]:
+        """Return cached vectors for the given normalized texts (missing ones are simply absent)."""
+        found = {}
+        for text in texts:
+            vector = self._memory.get(text)
+            if vector is not None:
+                self._memory.move_to_end(text)
+                found[text] = vector
+        self.counters["memory_hits"] += len(found)
+
+        missing = [t for t in texts if t not in found]
+        if missing and self.collection is not None:
+            try:
+                docs = await self.collection.find(
+                    {"_id": {"$in": [self._key(t) for t in missing]}}
+                ).to_list(length=None)
+            except Exception as e:
+                print(f"Embedding cache lookup failed: {e}")
+                docs = []
+            prefix = len(self.model_name) + 1
+            for doc in docs:
+                text = doc["_id"][prefix:]
+                vector = np.asarray(doc["vector"], dtype=np.float32)
+                found[text] = vector
+                self._remember(text, vector)
+            self.counters["persistent_hits"] += len(docs)
+
+        self.counters["misses"] += len(texts) - len(found)
+        return found
+
+    async def put_many(self, vectors: dict[str, np.ndarray]):
+        for text, vector in vectors.items():
+            self._remember(text, vector)
+        if self.collection is None or not vectors:
+            return
+        try:
+            await self.collection.bulk_write([
+                UpdateOne(
+                    {"_id": self._key(text)},
+                    {"$setOnInsert": {"vector": vector.tolist(), "model": self.model_name}},
+                    upsert=True
+                )
+                for text, vector in vectors.items()
+            ], ordered=False)
+        except Exception as e:
+            print(f"Embedding cache write failed: {e}")
+
+    def stats(self) -> dict:
+        hits = self.counters["memory_hits"] + self.counters["persistent_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._memory),
+            "persistent": self.collection is not None,
+        }
+
+
+# Initialize once (global)
+embedding_engine = EmbeddingEngine()
+embedding_cache = EmbeddingCache(
+    embedding_engine.model_name,
+    collection=embedding_cache_collection if EMBEDDING_CACHE_PERSIST else None
+)
+
+
+async def generate_embeddings_async(texts: List[str]) -> list:
+    """Generate embeddings asynchronously using FastEmbed.
+
+    Texts are normalized and looked up in the embedding cache first; only
+    the misses are sent (micro-batched) to the model.
+    """
+    normalized = [normalize_text(t) for t in texts]
+    unique = list(dict.fromkeys(normalized))
+    vectors = await embedding_cache.get_many(unique)
+
+    missing = [t for t in unique if t not in vectors]
+    if missing:
+        computed = dict(zip(missing, await embedding_engine.embed(missing)))
+        await embedding_cache.put_many(computed)
+        vectors.update(computed)
+
+    return [vectors[t] for t in normalized]
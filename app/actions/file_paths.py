@@ -0,0 +1,155 @@
+from app.dependency import file_paths_collection, posts_collection
+from collections import OrderedDict
+from datetime import datetime
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+FILE_PATH_CACHE_SIZE = int(os.getenv("FILE_PATH_CACHE_SIZE", "50000"))
+FILE_PATH_BATCH_SIZE = int(os.getenv("FILE_PATH_BATCH_SIZE", "500"))
+RESOLUTIONS = ("high", "medium")
+
+
+class FilePathIndex:
+    """Maps every file path Telegram ever issued for a post to (post_id, resolution, user_id).
+
+    Backed by the `file_paths` collection (the path is the _id, so a lookup is
+    one point read) with a bounded LRU in front of it. Paths are recorded when
+    a post is saved and whenever a path is refreshed; old paths are never
+    removed until the post is deleted, so stale links keep resolving. Posts
+    saved before this table existed are found once through the legacy
+    file_details query and recorded then.
+    """
+
+    def __init__(self, max_entries: int = FILE_PATH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self.counters = {"memory_hits": 0, "table_hits": 0, "legacy_hits": 0, "misses": 0, "recorded": 0}
+
+    def _remember(self, file_path: str, identity: dict):
+        self._memory[file_path] = identity
+        self._memory.move_to_end(file_path)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def resolve(self, file_path: str) -> dict | None:
+        """{"post_id", "resolution", "user_id"} for a current or previously issued path, or None."""
+        identity = self._memory.get(file_path)
+        if identity is not None:
+            self._memory.move_to_end(file_path)
+            self.counters["memory_hits"] += 1
+            return identity
+
+        doc = await file_paths_collection.find_one({"_id": file_path})
+        if doc:
+            self.counters["table_hits"] += 1
+            identity = {"post_id": doc["post_id"], "resolution": doc["resolution"], "user_id": doc.get("user_id")}
+            self._remember(file_path, identity)
+            return identity
+
+        post = await posts_collection.find_one(
+            {"$or": [{f"file_details.{r}.file_path": file_path} for r in RESOLUTIONS]},
+            {"user_id": 1, "file_details": 1}
+        )
+        if not post:
+            self.counters["misses"] += 1
+            return None
+        self.counters["legacy_hits"] += 1
+        await self.record_post(post["_id"], post.get("user_id"), post.get("file_details") or {})
+        return self._memory.get(file_path)
+
+    async def resolve_many(self, file_paths: list[str]) -> dict[str, dict]:
+        """Batch `resolve`: {path: identity} for every path that resolves (unknown paths are absent).
+
+        Memory hits cost nothing; the rest take one $in query per FILE_PATH_BATCH_SIZE
+        paths, plus one legacy query per batch for paths the table does not know yet.
+        """
+        found = {}
+        pending = []
+        for file_path in dict.fromkeys(file_paths):
+            identity = self._memory.get(file_path)
+            if identity is not None:
+                self._memory.move_to_end(file_path)
+                found[file_path] = identity
+            else:
+                pending.append(file_path)
+        self.counters["memory_hits"] += len(found)
+
+        for start in range(0, len(pending), FILE_PATH_BATCH_SIZE):
+            chunk = pending[start:start + FILE_PATH_BATCH_SIZE]
+            docs = await file_paths_collection.find({"_id": {"$in": chunk}}).to_list(length=len(chunk))
+            for doc in docs:
+                identity = {"post_id": doc["post_id"], "resolution": doc["resolution"], "user_id": doc.get("user_id")}
+                found[doc["_id"]] = identity
+                self._remember(doc["_id"], identity)
+            self.counters["table_hits"] += len(docs)
+
+            unknown = [p for p in chunk if p not in found]
+            if not unknown:
+                continue
+            posts = await posts_collection.find(
+                {"$or": [{f"file_details.{r}.file_path": {"$in": unknown}} for r in RESOLUTIONS]},
+                {"user_id": 1, "file_details": 1}
+            ).to_list(length=None)
+            for post in posts:
+                await self.record_post(post["_id"], post.get("user_id"), post.get("file_details") or {})
+            for file_path in unknown:
+                identity = self._memory.get(file_path)
+                if identity is not None:
+                    found[file_path] = identity
+                    self.counters["legacy_hits"] += 1
+                else:
+                    self.counters["misses"] += 1
+        return found
+
+    async def record(self, file_path: str, post_id, resolution: str, user_id: str | None = None):
+        """Remember a newly issued path for a post's file."""
+        if not file_path:
+            return
+        await file_paths_collection.update_one(
+            {"_id": file_path},
+            {"$setOnInsert": {"post_id": post_id, "resolution": resolution, "user_id": user_id, "created_at": datetime.now()}},
+            upsert=True
+        )
+        self.counters["recorded"] += 1
+        self._remember(file_path, {"post_id": post_id, "resolution": resolution, "user_id": user_id})
+
+    async def record_post(self, post_id, user_id: str | None, file_details: dict):
+        """Record the paths of every resolution in a post's file_details."""
+        paths = {
+            details["file_path"]: resolution
+            for resolution in RESOLUTIONS
+            if (details := file_details.get(resolution)) and details.get("file_path")
+        }
+        if not paths:
+            return
+        await file_paths_collection.bulk_write([
+            UpdateOne(
+                {"_id": file_path},
+                {"$setOnInsert": {"post_id": post_id, "resolution": resolution, "user_id": user_id, "created_at": datetime.now()}},
+                upsert=True
+            )
+            for file_path, resolution in paths.items()
+        ], ordered=False)
+        self.counters["recorded"] += len(paths)
+        for file_path, resolution in paths.items():
+            self._remember(file_path, {"post_id": post_id, "resolution": resolution, "user_id": user_id})
+
+    async def forget_post(self, post_id):
+        await file_paths_collection.delete_many({"post_id": post_id})
+        for file_path in [p for p, identity in self._memory.items() if identity["post_id"] == post_id]:
+            del self._memory[file_path]
+
+    def stats(self) -> dict:
+        hits = self.counters["memory_hits"] + self.counters["table_hits"] + self.counters["legacy_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "memory_hit_ratio": round(self.counters["memory_hits"] / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+
+file_path_index = FilePathIndex()
@@ -0,0 +1,130 @@
+from app.actions.singleflight import SingleFlight
+from app.actions.image_cache import image_cache
+from app.actions.file_paths import file_path_index
+from app.actions.telegram_bot import refresh_post_file_path, get_file_path, fetch_file_identity
+from app.dependency import posts_collection
+from dotenv import load_dotenv
+import asyncio, os, time
+
+load_dotenv()
+
+# Telegram guarantees a file link for at least an hour; renew well before that
+PATH_REFRESH_INTERVAL = float(os.getenv("PATH_REFRESH_INTERVAL", "300"))
+PATH_MAX_AGE = float(os.getenv("PATH_MAX_AGE", str(45 * 60)))
+PATH_RECENT_WINDOW = float(os.getenv("PATH_RECENT_WINDOW", str(24 * 3600)))
+PATH_REFRESH_MAX_TRACKED = int(os.getenv("PATH_REFRESH_MAX_TRACKED", "5000"))
+PATH_REFRESH_CONCURRENCY = 5
+
+path_refresh_flight = SingleFlight()
+identity_flight = SingleFlight()
+
+
+async def fetch_file_identity_once(file_path: str):
+    """fetch_file_identity, with concurrent lookups of the same path sharing one query."""
+    return await identity_flight.do(file_path, lambda: fetch_file_identity(file_path))
+
+
+async def refresh_file_path_once(post: dict):
+    """Refresh a stale file path, sharing one refresh between all concurrent callers for the same file."""
+    return await path_refresh_flight.do(post["cache_key"], lambda: refresh_post_file_path(post))
+
+
+class FilePathRefresher:
+    """Background renewal of file paths for recently viewed images.
+
+    /getImage records every resolved view; every PATH_REFRESH_INTERVAL seconds
+    paths that were last seen valid more than PATH_MAX_AGE ago are renewed via
+    getFile (no forwarding), so viewers rarely hit an expired link.
+    """
+
+    def __init__(self):
+        self._tracked: dict[str, dict] = {}
+        self._task: asyncio.Task | None = None
+        self.counters = {"runs": 0, "renewed": 0, "changed": 0, "failed": 0}
+
+    def record_view(self, post: dict, file_path: str):
+        """Track a view of a resolved post file (a fetch_file_identity result)."""
+        now = time.time()
+        key = post["cache_key"]
+        entry = self._tracked.pop(key, None)
+        if entry is None or entry["file_path"] != file_path:
+            entry = {
+                "post_id": post["_id"],
+                "user_id": post.get("user_id"),
+                "resolution": post.get("resolution"),
+                "file_id": post.get("file_id"),
+                "file_path": file_path,
+                "path_seen_at": now,
+            }
+        entry["last_viewed"] = now
+        self._tracked[key] = entry
+        if len(self._tracked) > PATH_REFRESH_MAX_TRACKED:
+            # dicts keep insertion order and views re-insert, so the first key is the least recently viewed
+            self._tracked.pop(next(iter(self._tracked)))
+
+    def touch(self, cache_key: str):
+        """Mark an already tracked file as viewed again."""
+        entry = self._tracked.get(cache_key)
+        if entry is not None:
+            entry["last_viewed"] = time.time()
+
+    async def _renew(self, key: str, entry: dict, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                file_path = await get_file_path(entry["file_id"])
+            except Exception as e:
+                print(f"File path renewal failed for {key}: {e}")
+                file_path = None
+        if not file_path:
+            # file_id is no longer usable; leave it to the on-demand refresh in /getImage
+            self.counters["failed"] += 1
+            self._tracked.pop(key, None)
+            return
+        self.counters["renewed"] += 1
+        if file_path != entry["file_path"]:
+            self.counters["changed"] += 1
+            await posts_collection.update_one(
+                {"_id": entry["post_id"]},
+                {"$set": {f"file_details.{entry['resolution']}.file_path": file_path}}
+            )
+            await file_path_index.record(file_path, entry["post_id"], entry["resolution"], entry["user_id"])
+            image_cache.alias(file_path, key, current=True)
+            entry["file_path"] = file_path
+        entry["path_seen_at"] = time.time()
+
+    async def refresh_due(self):
+        """Renew every recently viewed path that is close to expiring."""
+        self.counters["runs"] += 1
+        now = time.time()
+        for key in [k for k, e in self._tracked.items() if now - e["last_viewed"] > PATH_RECENT_WINDOW]:
+            self._tracked.pop(key, None)
+        due = [(k, e) for k, e in self._tracked.items() if now - e["path_seen_at"] > PATH_MAX_AGE]
+        semaphore = asyncio.Semaphore(PATH_REFRESH_CONCURRENCY)
+        await asyncio.gather(*(self._renew(k, e, semaphore) for k, e in due))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(PATH_REFRESH_INTERVAL)
+            try:
+                await self.refresh_due()
+            except Exception as e:
+                print(f"File path refresher error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {**self.counters, "tracked": len(self._tracked)}
+
+
+file_path_refresher = FilePathRefresher()
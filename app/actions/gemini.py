@@ -0,0 +1,115 @@
+from app.dependency import client
+from app.actions.resilience import CircuitBreaker, CircuitOpen, backoff_delay
+from dotenv import load_dotenv
+import asyncio, os, time
+
+load_dotenv()
+
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "2"))
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "60"))
+
+# Only rate limiting and server-side errors are worth retrying (and count against the breaker)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+_breakers: dict[str, CircuitBreaker] = {}
+_metrics: dict[str, dict] = {}
+
+
+def _breaker(model: str) -> CircuitBreaker:
+    if model not in _breakers:
+        _breakers[model] = CircuitBreaker(GEMINI_BREAKER_THRESHOLD, GEMINI_BREAKER_RESET)
+    return _breakers[model]
+
+
+def _model_metrics(model: str) -> dict:
+    if model not in _metrics:
+        _metrics[model] = {
+            "calls": 0, "failures": 0, "timeouts": 0, "retries": 0,
+            "short_circuited": 0, "total_ms": 0.0, "max_ms": 0.0,
+            "prompt_tokens": 0, "output_tokens": 0,
+        }
+    return _metrics[model]
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_STATUS
+
+
+def _is_outage(error: Exception) -> bool:
+    """Timeouts, connection errors (no HTTP status at all), 5xx and 429; a 4xx means the model answered."""
+    code = getattr(error, "code", None)
+    return not isinstance(code, int) or code == 429 or code >= 500
+
+
+async def generate_content(model: str, contents, config=None, timeout: float = GEMINI_TIMEOUT):
+    """Call Gemini through the async client without ever blocking the event loop.
+
+    Calls are capped process-wide by a semaphore, each attempt is bounded by
+    `timeout`, retryable failures back off with jitter, and a per-model
+    circuit breaker raises CircuitOpen instead of calling a degraded model.
+    """
+    breaker = _breaker(model)
+    stats = _model_metrics(model)
+    trial = breaker.state == "half_open"
+    if not breaker.allow():
+        stats["short_circuited"] += 1
+        raise CircuitOpen(f"Gemini model {model} is unavailable")
+
+    try:
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            if attempt:
+                stats["retries"] += 1
+            started = time.perf_counter()
+            try:
+                async with _semaphore:
+                    response = await asyncio.wait_for(
+                        client.aio.models.generate_content(model=model, contents=contents, config=config),
+                        timeout
+                    )
+            except Exception as e:
+                stats["failures"] += 1
+                if isinstance(e, asyncio.TimeoutError):
+                    stats["timeouts"] += 1
+                if attempt < GEMINI_MAX_RETRIES and _is_retryable(e):
+                    await asyncio.sleep(backoff_delay(attempt, base=1.0))
+                    continue
+                if _is_outage(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise
+            finally:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                stats["calls"] += 1
+                stats["total_ms"] += elapsed_ms
+                stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+            breaker.record_success()
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                stats["prompt_tokens"] += usage.prompt_token_count or 0
+                stats["output_tokens"] += usage.candidates_token_count or 0
+            return response
+    finally:
+        # A cancelled trial records no outcome; free the half-open slot for the next call
+        if trial:
+            breaker.release()
+
+
+def gemini_metrics() -> dict:
+    models = {}
+    for model, stats in _metrics.items():
+        successes = stats["calls"] - stats["failures"]
+        models[model] = {
+            **{k: round(v, 2) if isinstance(v, float) else v for k, v in stats.items()},
+            "avg_ms": round(stats["total_ms"] / stats["calls"], 2) if stats["calls"] else 0.0,
+            "avg_prompt_tokens": round(stats["prompt_tokens"] / successes, 1) if successes else 0.0,
+            "breaker": _breaker(model).state,
+        }
+    return models
@@ -0,0 +1,84 @@
+from datetime import datetime
+from email.utils import formatdate
+import hashlib
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def etag_for_key(cache_key: str) -> str:
+    """Strong ETag for an image. The bytes behind a file identity never change, so the identity is enough."""
+    return '"' + hashlib.sha256(cache_key.encode()).hexdigest()[:32] + '"'
+
+
+def http_date(value) -> str | None:
+    """Format a datetime or unix timestamp as an HTTP date (RFC 7231)."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        value = value.timestamp()
+    return formatdate(value, usegmt=True)
+
+
+def image_headers(file_path: str, etag: str | None = None, last_modified=None) -> dict:
+    """Common response headers for /getImage."""
+    headers = {"X-File-Path": file_path, "Accept-Ranges": "bytes"}
+    if etag:
+        headers["ETag"] = etag
+        headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """True if an If-None-Match header matches the given ETag (weak comparison, per RFC 7232)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def requested_range(range_header: str | None, if_range: str | None, etag: str | None) -> str | None:
+    """Return the Range header to honour, dropping it when If-Range no longer matches."""
+    if not range_header:
+        return None
+    if if_range and if_range.strip() != etag:
+        return None
+    return range_header
+
+
+class RangeNotSatisfiable(ValueError):
+    """A well-formed byte range that lies outside the body; answered with 416."""
+
+
+def parse_byte_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """Parse a single "bytes=start-end" range against a body of the given size.
+
+    Returns the inclusive (start, end) pair, or None for a header to ignore
+    (malformed, or another unit), in which case the full body is served.
+    Raises RangeNotSatisfiable for a valid range outside the body. Multi-range
+    requests are answered with their first range.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    first = spec.split(",")[0].strip()
+    start_text, dash, end_text = first.partition("-")
+    start_text, end_text = start_text.strip(), end_text.strip()
+    if not dash or not (start_text or end_text) or not all(t.isdigit() for t in (start_text, end_text) if t):
+        return None
+    if not start_text:
+        # Suffix range: the last N bytes
+        length = int(end_text)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable(range_header)
+        return max(size - length, 0), size - 1
+    start = int(start_text)
+    end = int(end_text) if end_text else None
+    if end is not None and end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(range_header)
+    return start, size - 1 if end is None else min(end, size - 1)
@@ -0,0 +1,35 @@
+import aiohttp
+import os
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+
+_session: aiohttp.ClientSession | None = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the process-wide aiohttp session, creating it on first use.
+
+    The session keeps a keep-alive connection pool so outbound calls reuse
+    sockets instead of paying DNS/TCP/TLS setup on every request.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                connect=HTTP_CONNECT_TIMEOUT,
+                sock_read=HTTP_READ_TIMEOUT
+            )
+        )
+    return _session
+
+
+async def close_session():
+    """Close the shared session (called from the app lifespan)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -0,0 +1,255 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from dotenv import load_dotenv
+import asyncio, hashlib, os
+
+load_dotenv()
+
+IMAGE_CACHE_MEMORY_BYTES = int(os.getenv("IMAGE_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+IMAGE_CACHE_DISK_BYTES = int(os.getenv("IMAGE_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+IMAGE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("IMAGE_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024)))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "/tmp/vsnbrd-image-cache")
+IMAGE_CACHE_MAX_ALIASES = 50_000
+
+
+@dataclass
+class CachedImage:
+    content: bytes
+    media_type: str
+    last_modified: float | None = None
+    file_path: str | None = None  # the path the bytes were fetched from
+
+
+def image_cache_key(file_unique_id: str | None, post_id=None, resolution: str | None = None) -> str:
+    """Stable cache key for a Telegram file.
+
+    Prefers Telegram's file_unique_id (same for every file_id/file_path ever
+    issued for the file); posts saved before it was stored fall back to the
+    post id + resolution, which is just as stable for our purposes.
+    """
+    if file_unique_id:
+        return f"tg:{file_unique_id}"
+    return f"post:{post_id}:{resolution}"
+
+
+class ImageCache:
+    """Two-tier image byte cache: size-bounded memory LRU in front of a size-bounded disk LRU.
+
+    Entries are keyed on stable file identity (see image_cache_key). Expiring
+    Telegram file paths are only remembered as aliases pointing at a key, so a
+    refreshed path keeps hitting the same bytes; the newest path known for a
+    key is what a cache hit reports back to the client.
+    """
+
+    def __init__(self, memory_bytes: int, disk_bytes: int, max_entry_bytes: int, disk_dir: str | None = None):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.disk_dir = disk_dir or None
+
+        self._memory: OrderedDict[str, CachedImage] = OrderedDict()
+        self._memory_size = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()  # key hash -> size on disk
+        self._disk_size = 0
+        self._disk_loaded = False
+        self._disk_loading: asyncio.Task | None = None
+        self._aliases: OrderedDict[str, str] = OrderedDict()
+        self._current_paths: OrderedDict[str, str] = OrderedDict()  # key -> newest file_path
+
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "stores": 0,
+            "too_large": 0,
+        }
+
+    # ---------- path aliases ----------
+
+    def alias(self, file_path: str, key: str, current: bool = False):
+        """Remember that a (possibly expiring) file_path refers to a cache key.
+
+        `current` marks it as the file's newest path, e.g. one just issued by Telegram.
+        """
+        self._aliases[file_path] = key
+        self._aliases.move_to_end(file_path)
+        while len(self._aliases) > IMAGE_CACHE_MAX_ALIASES:
+            self._aliases.popitem(last=False)
+        if current:
+            self._current_paths[key] = file_path
+            self._current_paths.move_to_end(key)
+            while len(self._current_paths) > IMAGE_CACHE_MAX_ALIASES:
+                self._current_paths.popitem(last=False)
+
+    def key_for_path(self, file_path: str) -> str | None:
+        return self._aliases.get(file_path)
+
+    def current_path(self, key: str, entry: CachedImage | None = None) -> str | None:
+        """The newest file_path known for a key: the latest current alias, else the one stored with the entry."""
+        return self._current_paths.get(key) or (entry.file_path if entry else None)
+
+    # ---------- lookups ----------
+
+    async def get(self, key: str) -> CachedImage | None:
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return entry
+
+        entry = await self._disk_get(key)
+        if entry is not None:
+            self.counters["disk_hits"] += 1
+            self._memory_put(key, entry)
+            return entry
+
+        self.counters["misses"] += 1
+        return None
+
+    async def put(self, key: str, content: bytes, media_type: str, last_modified: float | None = None, file_path: str | None = None):
+        if len(content) > self.max_entry_bytes:
+            self.counters["too_large"] += 1
+            return
+        if file_path and key not in self._current_paths:
+            self.alias(file_path, key, current=True)
+        entry = CachedImage(content=content, media_type=media_type, last_modified=last_modified, file_path=file_path)
+        self.counters["stores"] += 1
+        self._memory_put(key, entry)
+        await self._disk_put(key, entry)
+
+    def stats(self) -> dict:
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_size,
+            "aliases": len(self._aliases),
+        }
+
+    # ---------- memory tier ----------
+
+    def _memory_put(self, key: str, entry: CachedImage):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old.content)
+        self._memory[key] = entry
+        self._memory_size += len(entry.content)
+        while self._memory_size > self.memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted.content)
+            self.counters["memory_evictions"] += 1
+
+    # ---------- disk tier ----------
+
+    def _disk_name(self, key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _load_disk_index(self):
+        """Rebuild the disk LRU from the cache directory, oldest access first."""
+        os.makedirs(self.disk_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_size += size
+
+    async def _ensure_disk_index(self):
+        """Scan the cache directory once; concurrent callers wait for the same scan."""
+        if self._disk_loaded:
+            return
+        if self._disk_loading is None:
+            self._disk_loading = asyncio.ensure_future(asyncio.to_thread(self._load_disk_index))
+        try:
+            await asyncio.shield(self._disk_loading)
+        except OSError:
+            self._disk_loading = None  # let the next call retry the scan
+            raise
+        self._disk_loaded = True
+
+    async def _disk_get(self, key: str) -> CachedImage | None:
+        if not self.disk_dir:
+            return None
+        try:
+            await self._ensure_disk_index()
+            name = self._disk_name(key)
+            if name not in self._disk:
+                return None
+            self._disk.move_to_end(name)
+            raw = await asyncio.to_thread(self._read_file, os.path.join(self.disk_dir, name))
+        except OSError as e:
+            print(f"Image cache disk read failed: {e}")
+            self._disk_size -= self._disk.pop(self._disk_name(key), 0)
+            return None
+        header, _, content = raw.partition(b"\n")
+        media_type, _, rest = header.decode().partition(" ")
+        last_modified, _, file_path = rest.partition(" ")
+        return CachedImage(
+            content=content,
+            media_type=media_type,
+            last_modified=float(last_modified) if last_modified else None,
+            file_path=file_path or None
+        )
+
+    async def _disk_put(self, key: str, entry: CachedImage):
+        if not self.disk_dir:
+            return
+        name = self._disk_name(key)
+        header = f"{entry.media_type} {entry.last_modified or ''} {entry.file_path or ''}".rstrip()
+        raw = header.encode() + b"\n" + entry.content
+        try:
+            await self._ensure_disk_index()
+            await asyncio.to_thread(self._write_file, os.path.join(self.disk_dir, name), raw)
+        except OSError as e:
+            print(f"Image cache disk write failed: {e}")
+            return
+        self._disk_size -= self._disk.pop(name, 0)
+        self._disk[name] = len(raw)
+        self._disk_size += len(raw)
+        while self._disk_size > self.disk_bytes and self._disk:
+            evicted, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self.counters["disk_evictions"] += 1
+            await asyncio.to_thread(self._remove_file, os.path.join(self.disk_dir, evicted))
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            raw = f.read()
+        os.utime(path)  # keep mtime as the LRU order across restarts
+        return raw
+
+    @staticmethod
+    def _write_file(path: str, raw: bytes):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(raw)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+image_cache = ImageCache(
+    memory_bytes=IMAGE_CACHE_MEMORY_BYTES,
+    disk_bytes=IMAGE_CACHE_DISK_BYTES,
+    max_entry_bytes=IMAGE_CACHE_MAX_ENTRY_BYTES,
+    disk_dir=IMAGE_CACHE_DIR,
+)
@@ -0,0 +1,129 @@
+from app.dependency import db
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from bson import ObjectId
+from datetime import datetime
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+UPDATE_RETENTION_SECONDS = int(os.getenv("UPDATE_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# Every index the queries in this app rely on, by collection.
+# Atlas Search / Vector Search indexes (tag_search, vector_index) are managed in Atlas, not here.
+INDEXES: dict[str, list[IndexModel]] = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], name="user_id", unique=True),
+    ],
+    "posts": [
+        IndexModel([("user_id", ASCENDING), ("_id", DESCENDING)], name="user_id_id"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_id_created_at_id"),
+        IndexModel([("user_id", ASCENDING), ("message_id", ASCENDING)], name="user_id_message_id"),
+        IndexModel([("user_id", ASCENDING), ("tag_names", ASCENDING)], name="user_id_tag_names"),
+        IndexModel([("tag_names", ASCENDING)], name="tag_names"),
+        IndexModel([("file_details.high.file_path", ASCENDING)], name="high_file_path"),
+        IndexModel([("file_details.medium.file_path", ASCENDING)], name="medium_file_path"),
+    ],
+    "tags": [
+        IndexModel([("user_id", ASCENDING), ("name", ASCENDING)], name="user_id_name", unique=True),
+        IndexModel([("name", ASCENDING)], name="name"),
+    ],
+    "boards": [
+        IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)], name="user_id_id"),
+        IndexModel([("posts", ASCENDING)], name="posts"),
+    ],
+    "invoices": [
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING), ("payment_date", DESCENDING)], name="user_id_status_payment_date"),
+    ],
+    "updates": [
+        IndexModel([("status", ASCENDING), ("enqueued_at", ASCENDING)], name="status_enqueued_at"),
+        # Processed updates are only kept for deduplication and debugging
+        IndexModel([("done_at", ASCENDING)], name="done_at_ttl", expireAfterSeconds=UPDATE_RETENTION_SECONDS),
+    ],
+    "file_paths": [
+        # _id is the file path itself (unique); this serves cleanup on post deletion
+        IndexModel([("post_id", ASCENDING)], name="post_id"),
+    ],
+    "tag_results": [
+        IndexModel([("user_id", ASCENDING), ("file_unique_ids", ASCENDING)], name="user_id_file_unique_ids"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at"),
+    ],
+}
+
+# Representative shapes of the hot queries; verify_query_plans fails any that would scan a collection.
+_ID = ObjectId()
+HOT_QUERIES: list[dict] = [
+    {"name": "user by id", "collection": "users", "filter": {"user_id": "0"}},
+    {"name": "posts of user", "collection": "posts", "filter": {"user_id": "0"}, "sort": {"_id": -1}},
+    {"name": "post feed page", "collection": "posts", "filter": {"user_id": "0", "$or": [{"created_at": {"$lt": datetime.now()}}, {"created_at": datetime.now(), "_id": {"$lt": _ID}}]}, "sort": {"created_at": -1, "_id": -1}},
+    {"name": "duplicate post", "collection": "posts", "filter": {"user_id": "0", "message_id": "0"}},
+    {"name": "post by file path", "collection": "posts", "filter": {"$or": [{"file_details.high.file_path": "p"}, {"file_details.medium.file_path": "p"}]}},
+    {"name": "posts by tags", "collection": "posts", "filter": {"user_id": "0", "tag_names": {"$in": ["a", "b"]}}, "sort": {"_id": -1}},
+    {"name": "other post with tag", "collection": "posts", "filter": {"tag_names": "a", "user_id": "0"}},
+    {"name": "boolean page", "collection": "posts", "filter": {"$and": [{"user_id": "0"}, {"tag_names": {"$all": ["a", "b"]}}, {"_id": {"$lt": _ID}}]}, "sort": {"_id": -1}},
+    {"name": "tag upsert", "collection": "tags", "filter": {"name": "a", "user_id": "0"}},
+    {"name": "tag by name", "collection": "tags", "filter": {"name": "a"}},
+    {"name": "tags of user", "collection": "tags", "filter": {"user_id": "0"}},
+    {"name": "boards of user", "collection": "boards", "filter": {"user_id": "0", "_id": {"$gt": _ID}}, "sort": {"_id": 1}},
+    {"name": "boards with post", "collection": "boards", "filter": {"posts": _ID}},
+    {"name": "pending invoice", "collection": "invoices", "filter": {"user_id": "0", "status": "pending"}, "sort": {"payment_date": -1}},
+    {"name": "reclaim updates", "collection": "updates", "filter": {"status": "pending", "lease_until": {"$lt": datetime.now()}}, "sort": {"enqueued_at": 1}},
+    {"name": "file path lookup", "collection": "file_paths", "filter": {"_id": "p"}},
+    {"name": "file paths of post", "collection": "file_paths", "filter": {"post_id": _ID}},
+    {"name": "tag result by file", "collection": "tag_results", "filter": {"user_id": "0", "$or": [{"_id": "0:x"}, {"file_unique_ids": "x"}]}},
+    {"name": "phash candidates", "collection": "tag_results", "filter": {"user_id": "0", "phash": {"$ne": None}}, "sort": {"created_at": -1}},
+]
+
+
+async def ensure_indexes() -> dict:
+    """Create any missing registry indexes; returns {collection: [index names] or error}."""
+    report = {}
+    for collection, models in INDEXES.items():
+        try:
+            report[collection] = await db[collection].create_indexes(models)
+        except PyMongoError as e:
+            # e.g. an existing index with the same keys but other options, or duplicate keys for a unique index
+            print(f"Could not ensure indexes on {collection}: {e}")
+            report[collection] = f"error: {e}"
+    return report
+
+
+async def missing_indexes() -> dict[str, list[str]]:
+    """Registry indexes that do not exist (by name) in the database."""
+    missing = {}
+    for collection, models in INDEXES.items():
+        existing = {index["name"] async for index in await db[collection].list_indexes()}
+        names = [model.document["name"] for model in models if model.document["name"] not in existing]
+        if names:
+            missing[collection] = names
+    return missing
+
+
+def _stages(plan: dict):
+    """Every stage name in a (possibly nested) explain plan."""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+async def explain_query(query: dict) -> dict:
+    command = {"find": query["collection"], "filter": query["filter"]}
+    if query.get("sort"):
+        command["sort"] = query["sort"]
+    result = await db.command({"explain": command, "verbosity": "queryPlanner"})
+    return result["queryPlanner"]["winningPlan"]
+
+
+async def verify_query_plans(queries: list[dict] = HOT_QUERIES) -> list[dict]:
+    """Explain each hot query; returns [{"name", "stages", "ok"}] where ok is False on a COLLSCAN."""
+    results = []
+    for query in queries:
+        stages = list(_stages(await explain_query(query)))
+        results.append({"name": query["name"], "stages": stages, "ok": "COLLSCAN" not in stages})
+    return results
@@ -0,0 +1,55 @@
+from collections import deque
+from contextlib import contextmanager
+import time
+
+
+class StageTimer:
+    """Wall-clock time per named stage of a single request."""
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = (time.perf_counter() - started) * 1000
+
+    async def measure(self, name: str, awaitable):
+        """Await `awaitable` and record it as a stage; usable inside asyncio.gather."""
+        with self.stage(name):
+            return await awaitable
+
+    def server_timing(self) -> str:
+        """Value for the Server-Timing response header."""
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.stages.items())
+
+
+class LatencyStats:
+    """Rolling per-stage latency summary over the last `window` requests."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: dict[str, deque] = {}
+
+    def record(self, timer: StageTimer):
+        for name, ms in timer.stages.items():
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(ms)
+
+    def stats(self) -> dict:
+        summary = {}
+        for name, samples in self._samples.items():
+            ordered = sorted(samples)
+            summary[name] = {
+                "count": len(ordered),
+                "avg_ms": round(sum(ordered) / len(ordered), 2),
+                "p50_ms": round(ordered[len(ordered) // 2], 2),
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+                "max_ms": round(ordered[-1], 2),
+            }
+        return summary
+
+
+search_latency = LatencyStats()
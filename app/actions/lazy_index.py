@@ -0,0 +1,109 @@
+from app.dependency import users_collection
+from collections import OrderedDict
+import asyncio
+
+_instances: list["LazyUserIndexes"] = []
+
+
+class LazyUserIndexes:
+    """Per-user in-memory indexes, loaded lazily (one load per user at a time) and kept in an LRU.
+
+    Subclasses implement `_load(user_id)`. Write events go through `_apply`:
+    they update a loaded index in place, and while a user's load is in flight
+    they are buffered and replayed on the new index as soon as it is built, so
+    a write racing a load is not lost. Events must be idempotent, since the
+    load may already have seen the write.
+
+    Other processes write too, so each index remembers the user's
+    `stats.version` it is current with (`increment` bumps it on every post or
+    tag write). `get` re-reads the version and reloads an index that another
+    process has written past. An event carries the version its write produced
+    and is applied in place only on an index exactly one version behind;
+    otherwise the index is dropped and the next `get` reloads it. After its
+    own hooks, a write calls `user_written` so the indexes it did not touch
+    move to the new version too.
+    """
+
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self._users: OrderedDict[str, object] = OrderedDict()
+        self._versions: dict[str, int] = {}
+        self._loading: dict[str, asyncio.Task] = {}
+        self._buffered: dict[str, list] = {}
+        self.counters = {"loads": 0, "replayed_events": 0, "stale_reloads": 0}
+        _instances.append(self)
+
+    async def _load(self, user_id: str):
+        raise NotImplementedError
+
+    async def _current_version(self, user_id: str) -> int:
+        user = await users_collection.find_one({"user_id": user_id}, {"stats.version": 1, "_id": 0})
+        return ((user or {}).get("stats") or {}).get("version", 0)
+
+    async def _load_and_replay(self, user_id: str, version: int):
+        try:
+            index = await self._load(user_id)
+        except BaseException:
+            self._buffered.pop(user_id, None)
+            raise
+        # No await from here on, so no event can slip between replay and registration
+        for event, event_version in self._buffered.pop(user_id, []):
+            if event is not None:
+                event(index)
+                self.counters["replayed_events"] += 1
+            if event_version == version + 1:
+                version = event_version
+        self._users[user_id] = index
+        self._versions[user_id] = version
+        while len(self._users) > self.max_users:
+            evicted, _ = self._users.popitem(last=False)
+            self._versions.pop(evicted, None)
+        return index
+
+    def _drop(self, user_id: str):
+        self._users.pop(user_id, None)
+        self._versions.pop(user_id, None)
+
+    async def get(self, user_id: str):
+        # Read before loading: a write landing during the load makes the next get reload again
+        version = await self._current_version(user_id)
+        index = self._users.get(user_id)
+        if index is not None:
+            if self._versions.get(user_id, 0) >= version:
+                self._users.move_to_end(user_id)
+                return index
+            self.counters["stale_reloads"] += 1
+            self._drop(user_id)
+        task = self._loading.get(user_id)
+        if task is None:
+            self.counters["loads"] += 1
+            self._buffered[user_id] = []
+            task = self._loading[user_id] = asyncio.ensure_future(self._load_and_replay(user_id, version))
+            task.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    def _apply(self, user_id: str, event, version: int | None = None):
+        """Run `event(index)` on the user's index now, or after its in-flight load.
+
+        `version` is the user's `stats.version` after the write, as returned by `increment`.
+        """
+        index = self._users.get(user_id)
+        if index is not None:
+            current = self._versions.get(user_id, 0)
+            if version is not None and version <= current:
+                return
+            if version == current + 1:
+                if event is not None:
+                    event(index)
+                self._versions[user_id] = version
+            else:
+                # Missed a write (or cannot tell): reload rather than patch
+                self._drop(user_id)
+        elif user_id in self._buffered:
+            self._buffered[user_id].append((event, version))
+
+
+def user_written(user_id: str, version: int | None):
+    """Advance every index of the user to `version`; call it after the write's own hooks."""
+    for indexes in _instances:
+        indexes._apply(user_id, None, version)
@@ -1,113 +1,93 @@
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from fastapi import Request
+from starlette.datastructures import Headers
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 from app.actions.security import validate_init_data
-import traceback
+from dotenv import load_dotenv
+import hmac, os, traceback
 
-PUBLIC_ROUTES = ["/getImage","/","/docs", "/openapi.json", "/redoc", "/health","/webhook"]
+load_dotenv()
+
+PUBLIC_ROUTES = frozenset(["/getImage", "/", "/docs", "/openapi.json", "/redoc", "/health", "/webhook"])
+# Operator-only routes: "Authorization: Bearer <METRICS_TOKEN>" instead of init data; disabled when unset
+METRICS_ROUTES = frozenset(["/metrics"])
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Whole subtrees that skip auth (e.g. "/static/")
+PUBLIC_PREFIXES: tuple[str, ...] = ("/docs/",)
+
+
+def is_public_route(path: str) -> bool:
+    return path in PUBLIC_ROUTES or path.startswith(PUBLIC_PREFIXES)
+
+
+class UserValidationMiddleware:
+    """Rejects requests without valid Telegram Mini App init data ("Authorization: tma <initData>").
+
+    Plain ASGI middleware: authorised requests are passed straight through to
+    the app with the verified init data in `request.state.user`.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Skip OPTIONS requests (CORS preflight) and public routes
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or is_public_route(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        if scope["path"] in METRICS_ROUTES:
+            if self.metrics_authorized(headers.get("authorization")):
+                await self.app(scope, receive, send)
+            else:
+                await JSONResponse(status_code=401, content={"detail": "Metrics token required"})(scope, receive, send)
+            return
 
-class UserValidationMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
         try:
-            # ⭐ Skip OPTIONS requests (CORS preflight)
-            if request.method == "OPTIONS":
-                print(f"⚪ OPTIONS request to {request.url.path} - skipping auth")
-                return await call_next(request)
-            
-            # Allow public routes
-            if request.url.path in PUBLIC_ROUTES:
-                print(f"⚪ Public route {request.url.path} - skipping auth")
-                return await call_next(request)
-            
-            print(f"\n{'='*60}")
-            print(f"🔍 Checking auth for: {request.method} {request.url.path}")
-            print(f"Origin: {request.headers.get('origin', 'None')}")
-            
-            # Check for Authorization header
-            if "Authorization" not in request.headers:
-                print("❌ No Authorization header")
-                return JSONResponse(
-                    status_code=401,
-                    content={"detail": "Authorization header is required"},
-                    headers={
-                        "Access-Control-Allow-Origin": request.headers.get("origin", "*"),
-                        "Access-Control-Allow-Credentials": "true",
-                    }
-                )
-            
-            # Parse Authorization
-            auth_header = request.headers["Authorization"]
-            print(f"Authorization header: {auth_header[:50]}...")
-            
-            parts = auth_header.split(" ", 1)
-            if len(parts) != 2:
-                print("❌ Invalid Authorization format")
-                return JSONResponse(
-                    status_code=400,
-                    content={"detail": "Invalid Authorization header format"},
-                    headers={
-                        "Access-Control-Allow-Origin": request.headers.get("origin", "*"),
-                        "Access-Control-Allow-Credentials": "true",
-                    }
-                )
-            
-            auth_type, auth_data = parts
-            
-            if not auth_data or auth_data.strip() == "":
-                print("❌ Empty auth data")
-                return JSONResponse(
-                    status_code=401,
-                    content={"detail": "Authorization data is empty"},
-                    headers={
-                        "Access-Control-Allow-Origin": request.headers.get("origin", "*"),
-                        "Access-Control-Allow-Credentials": "true",
-                    }
-                )
-            
-            if auth_type.lower() != "tma":
-                print(f"❌ Invalid auth type: {auth_type}")
-                return JSONResponse(
-                    status_code=400,
-                    content={"detail": f"Invalid auth type: {auth_type}. Expected 'tma'"},
-                    headers={
-                        "Access-Control-Allow-Origin": request.headers.get("origin", "*"),
-                        "Access-Control-Allow-Credentials": "true",
-                    }
-                )
-            
-            # Validate init data
-            print("🔐 Validating init data...")
-            init_data = validate_init_data(auth_data, expires_in=3600)
-            
-            if not init_data:
-                print("❌ Invalid init data")
-                return JSONResponse(
-                    status_code=401,
-                    content={"detail": "Invalid or tampered init data"},
-                    headers={
-                        "Access-Control-Allow-Origin": request.headers.get("origin", "*"),
-                        "Access-Control-Allow-Credentials": "true",
-                    }
-                )
-            
-            print(f"✅ Auth successful for user: {init_data.get('user', {}).get('id', 'unknown')}")
-            print(f"{'='*60}\n")
-            
-            # Store user in request state
-            request.state.user = init_data
-            
-            # Continue to route
-            response = await call_next(request)
-            return response
-            
+            status_code, detail, init_data = self.authenticate(headers.get("authorization"))
         except Exception as e:
-            print(f"💥 Exception in middleware: {str(e)}")
             traceback.print_exc()
-            return JSONResponse(
-                status_code=500,
-                content={"detail": f"Internal server error: {str(e)}"},
+            status_code, detail, init_data = 500, f"Internal server error: {str(e)}", None
+
+        if init_data is None:
+            response = JSONResponse(
+                status_code=status_code,
+                content={"detail": detail},
                 headers={
-                    "Access-Control-Allow-Origin": request.headers.get("origin", "*"),
+                    "Access-Control-Allow-Origin": headers.get("origin", "*"),
                     "Access-Control-Allow-Credentials": "true",
                 }
-            )
\ No newline at end of file
+            )
+            await response(scope, receive, send)
+            return
+
+        # Store user in request state
+        scope.setdefault("state", {})["user"] = init_data
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def metrics_authorized(auth_header: str | None) -> bool:
+        if not METRICS_TOKEN or not auth_header:
+            return False
+        return hmac.compare_digest(auth_header.encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+    @staticmethod
+    def authenticate(auth_header: str | None) -> tuple[int, str, dict | None]:
+        """(status, detail, init_data); init_data is None when the request must be rejected."""
+        if auth_header is None:
+            return 401, "Authorization header is required", None
+
+        parts = auth_header.split(" ", 1)
+        if len(parts) != 2:
+            return 400, "Invalid Authorization header format", None
+
+        auth_type, auth_data = parts
+        if not auth_data or auth_data.strip() == "":
+            return 401, "Authorization data is empty", None
+        if auth_type.lower() != "tma":
+            return 400, f"Invalid auth type: {auth_type}. Expected 'tma'", None
+
+        init_data = validate_init_data(auth_data, expires_in=3600)
+        if not init_data:
+            return 401, "Invalid or tampered init data", None
+        return 200, "", init_data
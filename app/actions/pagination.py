@@ -0,0 +1,51 @@
+from bson import json_util
+from dotenv import load_dotenv
+import base64, os
+
+load_dotenv()
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "20"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "50"))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def page_size(limit: int | None) -> int:
+    """Clamp a client-requested page size to [1, MAX_PAGE_SIZE]."""
+    if not limit:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def encode_cursor(values: list) -> str:
+    """Opaque token for the sort key of the last item on a page (ObjectId/datetime safe)."""
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> list:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(values, list):
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+
+def keyset_filter(fields: list[str], values: list, descending: bool = True) -> dict:
+    """Match documents strictly after `values` in a sort on `fields` (all in the same direction).
+
+    For fields (a, b) descending this is: a < va OR (a == va AND b < vb).
+    """
+    if len(fields) != len(values):
+        raise InvalidCursor("Invalid cursor")
+    op = "$lt" if descending else "$gt"
+    clauses = []
+    for i, field in enumerate(fields):
+        clause = {f: v for f, v in zip(fields[:i], values[:i])}
+        clause[field] = {op: values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
@@ -0,0 +1,83 @@
+from app.dependency import posts_collection, boards_collection
+from app.actions.pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_filter
+from app.actions.streaming import STREAM_BATCH_SIZE
+from bson import ObjectId
+
+# Projections by view: "grid" carries only what a thumbnail grid needs, "full" is the whole post
+FEED_PROJECTIONS = {
+    "grid": {"file_details.medium.file_path": 1, "file_details.high.file_path": 1, "file_type": 1, "created_at": 1},
+    "full": None,
+}
+FEED_SORT = [("created_at", -1), ("_id", -1)]
+
+
+def feed_projection(view: str) -> dict | None:
+    if view not in FEED_PROJECTIONS:
+        raise ValueError(f"Unknown view: {view} (expected one of {', '.join(FEED_PROJECTIONS)})")
+    return FEED_PROJECTIONS[view]
+
+
+def user_posts_query(user_id: str, cursor: str | None = None) -> dict:
+    """Filter for the user's posts after `cursor`, for a FEED_SORT scan of the (user_id, created_at, _id) index."""
+    query = {"user_id": user_id}
+    if cursor:
+        query.update(keyset_filter([field for field, _ in FEED_SORT], decode_cursor(cursor)))
+    return query
+
+
+async def list_user_posts(user_id: str, page_size: int, cursor: str | None = None, view: str = "full") -> tuple[list[dict], str | None]:
+    """One page of the user's posts, newest first. Returns (posts, next_cursor)."""
+    posts = await posts_collection.find(
+        user_posts_query(user_id, cursor), feed_projection(view)
+    ).sort(FEED_SORT).limit(page_size + 1).to_list(length=page_size + 1)
+    next_cursor = None
+    if len(posts) > page_size:
+        posts = posts[:page_size]
+        next_cursor = encode_cursor([posts[-1]["created_at"], posts[-1]["_id"]])
+    return posts, next_cursor
+
+
+def stream_user_posts(user_id: str, cursor: str | None = None, view: str = "full"):
+    """Every post of the user after `cursor`, newest first, as an async iterator over one Mongo cursor."""
+    # Built eagerly so a bad cursor or view fails before the response starts
+    query, projection = user_posts_query(user_id, cursor), feed_projection(view)
+
+    async def posts():
+        async for post in posts_collection.find(query, projection).sort(FEED_SORT).batch_size(STREAM_BATCH_SIZE):
+            yield post
+    return posts()
+
+
+async def list_board_posts(board_id: str, page_size: int, cursor: str | None = None, view: str = "full") -> tuple[dict | None, list[dict], str | None]:
+    """
+    One page of a board's posts in the order of the board's `posts` array.
+    Returns (board, posts, next_cursor); board is None if it does not exist.
+
+    The cursor holds the last post id and its position, so a page boundary survives
+    posts being added or removed before it.
+    """
+    board = await boards_collection.find_one({"_id": ObjectId(board_id)}, {"posts": 1, "user_id": 1, "name": 1})
+    if board is None:
+        return None, [], None
+    post_ids = board.get("posts", [])
+
+    start = 0
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 2 or not isinstance(values[0], int):
+            raise InvalidCursor("Invalid cursor")
+        position, last_id = values
+        try:
+            start = post_ids.index(last_id) + 1
+        except ValueError:
+            start = min(max(position, 0), len(post_ids))
+
+    page_ids = post_ids[start:start + page_size]
+    docs = await posts_collection.find({"_id": {"$in": page_ids}}, feed_projection(view)).to_list(length=len(page_ids))
+    by_id = {doc["_id"]: doc for doc in docs}
+    posts = [by_id[post_id] for post_id in page_ids if post_id in by_id]
+
+    next_cursor = None
+    if start + page_size < len(post_ids):
+        next_cursor = encode_cursor([start + page_size, page_ids[-1]])
+    return board, posts, next_cursor
@@ -0,0 +1,191 @@
+from app.dependency import posts_collection
+from app.actions.lazy_index import LazyUserIndexes
+from dotenv import load_dotenv
+import numpy as np
+import asyncio, os
+
+load_dotenv()
+
+POST_INDEX_USERS = int(os.getenv("POST_INDEX_USERS", "100"))
+
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+
+class UserPostIndex:
+    """Inverted index of one user's posts: tag name -> sorted int32 array of document numbers.
+
+    Posts are numbered densely in _id order (so newest posts have the highest
+    numbers). AND is evaluated by intersecting posting arrays, OR and NOT on
+    bitmaps over the document numbers.
+    """
+
+    def __init__(self, posts: list[dict]):
+        self.post_ids = []
+        self.doc_of = {}
+        self._live = np.zeros(max(16, len(posts)), dtype=bool)
+        self.live_count = 0
+        postings: dict[str, list[int]] = {}
+        for post in posts:
+            doc = self._number(post["_id"])
+            for name in set(post.get("tag_names") or ()):
+                postings.setdefault(name, []).append(doc)
+        self.postings = {name: np.asarray(docs, dtype=np.int32) for name, docs in postings.items()}
+        self.lowercase = {}
+        for name in self.postings:
+            self.lowercase.setdefault(name.lower(), set()).add(name)
+
+    def __len__(self):
+        return self.live_count
+
+    def _number(self, post_id) -> int:
+        doc = self.doc_of.get(post_id)
+        if doc is None:
+            doc = self.doc_of[post_id] = len(self.post_ids)
+            self.post_ids.append(post_id)
+            if doc >= len(self._live):
+                self._live = np.concatenate([self._live, np.zeros(len(self._live), dtype=bool)])
+        if not self._live[doc]:
+            self._live[doc] = True
+            self.live_count += 1
+        return doc
+
+    def universe(self) -> np.ndarray:
+        return np.flatnonzero(self._live[:len(self.post_ids)]).astype(np.int32)
+
+    def union(self, arrays) -> np.ndarray:
+        """Union of sorted posting arrays via a bitmap over document numbers."""
+        mask = np.zeros(len(self.post_ids), dtype=bool)
+        for docs in arrays:
+            mask[docs] = True
+        return np.flatnonzero(mask).astype(np.int32)
+
+    def add_post(self, post_id):
+        self._number(post_id)
+
+    def add_tags(self, post_id, names: list[str]):
+        doc = self._number(post_id)
+        for name in names:
+            docs = self.postings.get(name, _EMPTY)
+            position = np.searchsorted(docs, doc)
+            if position < len(docs) and docs[position] == doc:
+                continue
+            self.postings[name] = np.insert(docs, position, doc)
+            self.lowercase.setdefault(name.lower(), set()).add(name)
+
+    def remove_tag(self, post_id, name: str):
+        doc = self.doc_of.get(post_id)
+        docs = self.postings.get(name)
+        if doc is None or docs is None:
+            return
+        position = np.searchsorted(docs, doc)
+        if position < len(docs) and docs[position] == doc:
+            docs = np.delete(docs, position)
+            if len(docs):
+                self.postings[name] = docs
+            else:
+                del self.postings[name]
+                self.lowercase.get(name.lower(), set()).discard(name)
+
+    def remove_post(self, post_id):
+        doc = self.doc_of.get(post_id)
+        if doc is None or not self._live[doc]:
+            return
+        self._live[doc] = False
+        self.live_count -= 1
+        for name in list(self.postings):
+            self.remove_tag(post_id, name)
+
+    def tag_docs(self, term: str) -> np.ndarray:
+        """Posts carrying the tag, matched case-insensitively."""
+        names = self.lowercase.get(term.lower())
+        if not names:
+            return _EMPTY
+        arrays = [self.postings[n] for n in names if n in self.postings]
+        if len(arrays) == 1:
+            return arrays[0]
+        return self.union(arrays) if arrays else _EMPTY
+
+    def evaluate(self, node) -> np.ndarray:
+        """Sorted document numbers matching a parsed boolean query."""
+        kind = node[0]
+        if kind == "tag":
+            return self.tag_docs(node[1])
+        if kind == "not":
+            mask = self._live[:len(self.post_ids)].copy()
+            mask[self.evaluate(node[1])] = False
+            return np.flatnonzero(mask).astype(np.int32)
+        if kind == "or":
+            return self.union(self.evaluate(child) for child in node[1])
+
+        # AND: intersect the positive terms smallest first, then subtract the negated ones
+        positive = [child for child in node[1] if child[0] != "not"]
+        negative = [child[1] for child in node[1] if child[0] == "not"]
+        arrays = sorted((self.evaluate(child) for child in positive), key=len)
+        result = arrays[0] if arrays else self.universe()
+        for docs in arrays[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, docs, assume_unique=True)
+        for child in negative:
+            if not len(result):
+                break
+            result = np.setdiff1d(result, self.evaluate(child), assume_unique=True)
+        return result
+
+    def page(self, node, limit: int, before_post_id=None) -> tuple[list, bool]:
+        """Newest-first post ids matching the query, strictly older than `before_post_id`.
+
+        Returns (post_ids, has_more).
+        """
+        docs = self.evaluate(node)
+        if before_post_id is not None:
+            before = self.doc_of.get(before_post_id)
+            if before is None:
+                return [], False
+            docs = docs[:np.searchsorted(docs, before)]
+        selected = docs[::-1][:limit + 1]
+        return [self.post_ids[d] for d in selected[:limit]], len(selected) > limit
+
+
+class PostTagIndex(LazyUserIndexes):
+    """Per-user UserPostIndex instances, loaded lazily and updated as posts and tags change.
+
+    Hooks take the `stats.version` returned by the `increment` for their write.
+    """
+
+    def __init__(self, max_users: int = POST_INDEX_USERS):
+        super().__init__(max_users)
+        self.counters["queries"] = 0
+
+    async def _load(self, user_id: str) -> UserPostIndex:
+        posts = await posts_collection.find(
+            {"user_id": user_id}, {"tag_names": 1}
+        ).sort("_id", 1).to_list(length=None)
+        return await asyncio.to_thread(UserPostIndex, posts)
+
+    async def page(self, user_id: str, node, limit: int, before_post_id=None) -> tuple[list, bool]:
+        self.counters["queries"] += 1
+        return (await self.get(user_id)).page(node, limit, before_post_id)
+
+    def post_added(self, user_id: str, post_id, version: int | None = None):
+        self._apply(user_id, lambda index: index.add_post(post_id), version)
+
+    def tags_added(self, user_id: str, post_id, names: list[str], version: int | None = None):
+        self._apply(user_id, lambda index: index.add_tags(post_id, names), version)
+
+    def tag_removed(self, user_id: str, post_id, name: str, version: int | None = None):
+        self._apply(user_id, lambda index: index.remove_tag(post_id, name), version)
+
+    def post_deleted(self, user_id: str, post_id, version: int | None = None):
+        self._apply(user_id, lambda index: index.remove_post(post_id), version)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "users_loaded": len(self._users),
+            "posts": sum(len(i) for i in self._users.values()),
+            "postings": sum(len(d) for i in self._users.values() for d in i.postings.values()),
+        }
+
+
+post_tag_index = PostTagIndex()
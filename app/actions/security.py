@@ -1,108 +1,112 @@
 import hashlib
 import hmac
 from urllib.parse import unquote, parse_qsl
+from collections import OrderedDict
 import json
 import os
-from datetime import datetime
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
 SECRET_KEY = os.getenv("BOT_API")
-# test
+INIT_DATA_CACHE_SIZE = int(os.getenv("INIT_DATA_CACHE_SIZE", "10000"))
+
+# HMAC key for init data, derived once from the bot token
+WEB_APP_SECRET = hmac.new(b"WebAppData", SECRET_KEY.encode(), hashlib.sha256).digest() if SECRET_KEY else None
+
+
+class InitDataCache:
+    """Verified init-data strings, each kept until its auth_date expiry (LRU-bounded)."""
+
+    def __init__(self, max_entries: int = INIT_DATA_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[dict, float]] = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get(self, key: tuple) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        data, expires_at = entry
+        if time.time() > expires_at:
+            del self._entries[key]
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        return data
+
+    def put(self, key: tuple, data: dict, expires_at: float):
+        self._entries[key] = (data, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {**self.counters, "entries": len(self._entries)}
+
+
+init_data_cache = InitDataCache()
+
 
 def validate_init_data(init_data_raw: str, expires_in: int = 3600) -> dict | None:
     """
     Validate Telegram Mini Apps init data.
-    
+
     Returns dict with user data if valid, None if invalid.
-    
+    A verified string is cached until auth_date + expires_in, so repeat requests
+    from the same Mini App session skip parsing and the HMAC.
+
     N_update: The endpoint should get the user_id from authentication rather than data passed in body
     """
+    if not init_data_raw or not init_data_raw.strip() or WEB_APP_SECRET is None:
+        return None
+
+    key = (init_data_raw, expires_in)
+    cached = init_data_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
-        # ❌ Check if empty
-        if not init_data_raw or init_data_raw.strip() == "":
-            print("❌ Init data is empty")
-            return None
-        
         # Parse the init data
         parsed_data = dict(parse_qsl(unquote(init_data_raw)))
-        
-        # ❌ Check if parsed data is empty
-        if not parsed_data:
-            print("❌ Parsed data is empty")
-            return None
-        
-        # Extract hash and auth_date
-        if "hash" not in parsed_data:
-            print("❌ Missing hash field")
-            return None
-        
-        if "auth_date" not in parsed_data:
-            print("❌ Missing auth_date field")
+        if "hash" not in parsed_data or "auth_date" not in parsed_data:
             return None
 
         hash_value = parsed_data.pop("hash")
         auth_date = int(parsed_data.get("auth_date", 0))
-        
+
         # Check if init data is expired
-        current_time = int(datetime.now().timestamp())
-        if current_time - auth_date > expires_in:
-            print(f"❌ Init data expired. Age: {current_time - auth_date}s, Max: {expires_in}s")
+        if time.time() - auth_date > expires_in:
             return None
-        
+
         # Create data check string (MUST BE SORTED ALPHABETICALLY)
         data_check_string = "\n".join(
             f"{k}={v}" for k, v in sorted(parsed_data.items())
         )
-        
-        print("\n=== VERIFICATION ===")
-        print(f"Data check string:\n{data_check_string}\n")
-        
-        # Create secret key from bot token
-        secret_key = hmac.new(
-            b"WebAppData",
-            SECRET_KEY.encode(),
-            hashlib.sha256
-        ).digest()
-        
-        # Verify hash using the secret key
         computed_hash = hmac.new(
-            secret_key,
+            WEB_APP_SECRET,
             data_check_string.encode(),
             hashlib.sha256
         ).hexdigest()
-        
-        print(f"Computed hash: {computed_hash}")
-        print(f"Telegram hash:  {hash_value}")
-        print(f"Match: {hmac.compare_digest(computed_hash, hash_value)}")
-        
         if not hmac.compare_digest(computed_hash, hash_value):
-            print("❌ Hash verification failed!")
             return None
-        
-        print("✅ Hash verified!")
-        
+
         # Parse user data if present
-        user_data = {}
-        if "user" in parsed_data:
-            try:
-                user_data = json.loads(parsed_data["user"])
-            except Exception as e:
-                print(f"❌ Failed to parse user data: {e}")
-                return None
-        
+        user_data = json.loads(parsed_data["user"]) if "user" in parsed_data else {}
+
         # Return validated data
-        return {
+        result = {
             "user": user_data,
             "auth_date": auth_date,
             "chat_instance": parsed_data.get("chat_instance"),
             "chat_type": parsed_data.get("chat_type"),
             "start_param": parsed_data.get("start_param"),
         }
-        
+        init_data_cache.put(key, result, auth_date + expires_in)
+        return result
+
     except Exception as e:
-        print(f"❌ Exception: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None
\ No newline at end of file
+        print(f"Init data validation error: {e}")
+        return None
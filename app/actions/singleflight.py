@@ -0,0 +1,30 @@
+import asyncio
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one in-flight task.
+
+    The first caller for a key starts the work; everyone arriving while it is
+    running awaits the same task and gets the same result (or exception).
+    The task is shielded, so a cancelled caller does not cancel the work for
+    the others.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.counters = {"calls": 0, "shared": 0}
+
+    async def do(self, key: str, fn):
+        """Run `fn()` (a coroutine function) once per key at a time."""
+        self.counters["calls"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.counters["shared"] += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {**self.counters, "inflight": len(self._inflight)}
@@ -0,0 +1,61 @@
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator
+from datetime import datetime
+from dotenv import load_dotenv
+import json, os
+
+load_dotenv()
+
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", "65536"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))  # documents per Mongo cursor batch
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "array": "application/json"}
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)  # ObjectId and friends
+
+
+def encode_doc(doc: dict) -> bytes:
+    return json.dumps(doc, default=_default, ensure_ascii=False).encode()
+
+
+async def stream_documents(docs: AsyncIterator[dict], fmt: str) -> AsyncIterator[bytes]:
+    """
+    Encode documents as they arrive, as NDJSON lines or as the elements of one JSON array.
+
+    The first document is flushed on its own so the client sees data immediately; after
+    that output is sent in chunks of about STREAM_CHUNK_BYTES. Only one chunk is held
+    in memory at a time.
+    """
+    buffer = bytearray(b"[" if fmt == "array" else b"")
+    first = True
+    try:
+        async for doc in docs:
+            if fmt == "array" and not first:
+                buffer += b","
+            buffer += encode_doc(doc)
+            if fmt == "ndjson":
+                buffer += b"\n"
+            if first or len(buffer) >= STREAM_CHUNK_BYTES:
+                yield bytes(buffer)
+                buffer.clear()
+            first = False
+    except Exception as e:
+        # Headers are already sent; NDJSON clients get an error line, an array is left unterminated
+        print(f"Streaming failed: {e}")
+        if fmt == "ndjson":
+            buffer += encode_doc({"ok": False, "message": str(e)}) + b"\n"
+        yield bytes(buffer)
+        return
+    if fmt == "array":
+        buffer += b"]"
+    if buffer:
+        yield bytes(buffer)
+
+
+def streaming_response(docs: AsyncIterator[dict], fmt: str, headers: dict | None = None) -> StreamingResponse:
+    if fmt not in STREAM_MEDIA_TYPES:
+        raise ValueError(f"Unknown stream format: {fmt} (expected one of {', '.join(STREAM_MEDIA_TYPES)})")
+    return StreamingResponse(stream_documents(docs, fmt), media_type=STREAM_MEDIA_TYPES[fmt], headers=headers)
@@ -0,0 +1,160 @@
+from app.dependency import tag_results_collection
+from collections import OrderedDict
+from datetime import datetime
+from dotenv import load_dotenv
+import asyncio, hashlib, io, os
+
+try:
+    from PIL import Image  # in requirements.txt; without it near-duplicate matching is off
+except ImportError:
+    Image = None
+
+load_dotenv()
+
+TAG_CACHE_MEMORY_ENTRIES = int(os.getenv("TAG_CACHE_MEMORY_ENTRIES", "10000"))
+TAG_CACHE_PHASH_DISTANCE = int(os.getenv("TAG_CACHE_PHASH_DISTANCE", "6"))
+TAG_CACHE_PHASH_CANDIDATES = 500
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _dhash(data: bytes) -> int:
+    image = Image.open(io.BytesIO(data)).convert("L").resize((9, 8))
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+async def perceptual_hash(data: bytes) -> int | None:
+    """64-bit difference hash of an image, or None when Pillow is not installed or decoding fails."""
+    if Image is None:
+        return None
+    try:
+        return await asyncio.to_thread(_dhash, data)
+    except Exception as e:
+        print(f"Perceptual hash failed: {e}")
+        return None
+
+
+def _to_int64(value: int) -> int:
+    """Mongo stores signed 64-bit integers."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _hamming(a: int, b: int) -> int:
+    mask = (1 << 64) - 1
+    return bin((a & mask) ^ (b & mask)).count("1")
+
+
+class TagResultCache:
+    """Reuse Gemini tag results for images we have already tagged.
+
+    Exact matches are found by Telegram's file_unique_id or the SHA-256 of the
+    image bytes, near-duplicates by perceptual hash among recent results. All
+    matches are per user: tags are generated from the user's own vocabulary,
+    so another user's result would leak their tag names. A small memory LRU
+    sits in front of the `tag_results` collection.
+
+    Lookups come in two steps so the perceptual hash (an image decode) is only
+    computed when both exact lookups miss: `lookup_exact`, then
+    `lookup_similar`.
+    """
+
+    def __init__(self, collection, memory_entries: int = TAG_CACHE_MEMORY_ENTRIES):
+        self.collection = collection
+        self.memory_entries = memory_entries
+        self._memory: OrderedDict[str, list[str]] = OrderedDict()
+        self.counters = {"file_id_hits": 0, "content_hits": 0, "perceptual_hits": 0, "misses": 0, "stores": 0}
+
+    def _remember(self, key: str, tags: list[str]):
+        self._memory[key] = tags
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _recall(self, key: str) -> list[str] | None:
+        tags = self._memory.get(key)
+        if tags is not None:
+            self._memory.move_to_end(key)
+        return tags
+
+    async def lookup_exact(self, user_id: str, file_unique_id: str | None, sha256: str) -> list[str] | None:
+        """Return tags previously generated for this user's image, by file_unique_id or content, or None."""
+        if file_unique_id and (tags := self._recall(f"fu:{user_id}:{file_unique_id}")) is not None:
+            self.counters["file_id_hits"] += 1
+            return tags
+        if (tags := self._recall(f"sha:{user_id}:{sha256}")) is not None:
+            self.counters["content_hits"] += 1
+            return tags
+
+        key = f"{user_id}:{sha256}"
+        exact = [{"_id": key}]
+        if file_unique_id:
+            exact.append({"file_unique_ids": file_unique_id})
+        doc = await self.collection.find_one({"user_id": user_id, "$or": exact}, {"tags": 1, "file_unique_ids": 1})
+        if doc:
+            kind = "content_hits" if doc["_id"] == key else "file_id_hits"
+            self.counters[kind] += 1
+            self._remember(f"sha:{user_id}:{sha256}", doc["tags"])
+            if file_unique_id:
+                self._remember(f"fu:{user_id}:{file_unique_id}", doc["tags"])
+            return doc["tags"]
+        return None
+
+    async def lookup_similar(self, user_id: str, file_unique_id: str | None, sha256: str, phash: int | None) -> list[str] | None:
+        """Return tags of a near-duplicate among the user's recent results, or None. Call after lookup_exact misses."""
+        if phash is not None:
+            candidates = await self.collection.find(
+                {"user_id": user_id, "phash": {"$ne": None}},
+                {"phash": 1, "tags": 1}
+            ).sort("created_at", -1).limit(TAG_CACHE_PHASH_CANDIDATES).to_list(length=TAG_CACHE_PHASH_CANDIDATES)
+            best = min(candidates, key=lambda c: _hamming(c["phash"], phash), default=None)
+            if best and _hamming(best["phash"], phash) <= TAG_CACHE_PHASH_DISTANCE:
+                self.counters["perceptual_hits"] += 1
+                # Record this exact image too, so an identical upload skips the scan
+                await self._record(user_id, file_unique_id, sha256, phash, best["tags"])
+                return best["tags"]
+
+        self.counters["misses"] += 1
+        return None
+
+    async def store(self, user_id: str, file_unique_id: str | None, sha256: str, phash: int | None, tags: list[str]):
+        """Record the tags generated for an image."""
+        self.counters["stores"] += 1
+        await self._record(user_id, file_unique_id, sha256, phash, tags)
+
+    async def _record(self, user_id: str, file_unique_id: str | None, sha256: str, phash: int | None, tags: list[str]):
+        self._remember(f"sha:{user_id}:{sha256}", tags)
+        if file_unique_id:
+            self._remember(f"fu:{user_id}:{file_unique_id}", tags)
+        update = {
+            "$setOnInsert": {
+                "user_id": user_id,
+                "sha256": sha256,
+                "tags": tags,
+                "phash": _to_int64(phash) if phash is not None else None,
+                "created_at": datetime.now(),
+            }
+        }
+        if file_unique_id:
+            update["$addToSet"] = {"file_unique_ids": file_unique_id}
+        await self.collection.update_one({"_id": f"{user_id}:{sha256}"}, update, upsert=True)
+
+    def stats(self) -> dict:
+        hits = self.counters["file_id_hits"] + self.counters["content_hits"] + self.counters["perceptual_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "perceptual_enabled": Image is not None,
+        }
+
+
+tag_result_cache = TagResultCache(tag_results_collection)
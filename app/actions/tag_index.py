@@ -0,0 +1,241 @@
+from app.dependency import tags_collection
+from app.actions.lazy_index import LazyUserIndexes
+from dotenv import load_dotenv
+import asyncio, os, re
+
+load_dotenv()
+
+TAG_INDEX_USERS = int(os.getenv("TAG_INDEX_USERS", "500"))
+MAX_EDITS = 2
+PREFIX_CANDIDATES = 200
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_END = "$"
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def allowed_edits(token: str) -> int:
+    """Typo budget by length, as search engines usually do: none for short words, up to MAX_EDITS for long ones."""
+    if len(token) < 3:
+        return 0
+    if len(token) < 5:
+        return 1
+    return MAX_EDITS
+
+
+def deletes(token: str, distance: int) -> set[str]:
+    """All variants of `token` with up to `distance` characters deleted (SymSpell)."""
+    variants, frontier = {token}, {token}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w)) if len(w) > 1}
+        variants |= frontier
+    return variants
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Damerau-Levenshtein (optimal string alignment) distance, or limit + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class LexicalTagIndex:
+    """One user's tag names indexed for autocomplete and typo-tolerant lookup.
+
+    Tag names are split into word tokens. A prefix trie over the tokens gives
+    autocomplete, and a bounded edit-distance walk over the same trie gives
+    typo-tolerant autocomplete ("tirma" -> "tiramisu"); a SymSpell delete
+    dictionary gives whole-word typo matches. The edit budget depends on the
+    query word's length (see allowed_edits), so unlike Atlas' flat maxEdits: 2
+    words under 5 characters get at most 1 edit. The first character must
+    match, like Atlas' prefixLength: 1.
+    """
+
+    def __init__(self, names: list[str] = ()):
+        self.token_tags: dict[str, set[str]] = {}
+        self.trie: dict = {}
+        self.variants: dict[str, set[str]] = {}
+        self.names: set[str] = set()
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name: str):
+        if name in self.names:
+            return
+        self.names.add(name)
+        for token in set(tokenize(name)):
+            tags = self.token_tags.setdefault(token, set())
+            if not tags:
+                self._index_token(token)
+            tags.add(name)
+
+    def remove(self, name: str):
+        if name not in self.names:
+            return
+        self.names.discard(name)
+        for token in set(tokenize(name)):
+            tags = self.token_tags.get(token)
+            if tags is None:
+                continue
+            tags.discard(name)
+            if not tags:
+                del self.token_tags[token]
+                self._unindex_token(token)
+
+    def _index_token(self, token: str):
+        node = self.trie
+        for char in token:
+            node = node.setdefault(char, {})
+        node[_END] = token
+        for variant in deletes(token, allowed_edits(token)):
+            self.variants.setdefault(variant, set()).add(token)
+
+    def _unindex_token(self, token: str):
+        path, node = [], self.trie
+        for char in token:
+            path.append((node, char))
+            node = node[char]
+        node.pop(_END, None)
+        for parent, char in reversed(path):
+            if parent[char]:
+                break
+            del parent[char]
+        for variant in deletes(token, allowed_edits(token)):
+            tokens = self.variants.get(variant)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self.variants[variant]
+
+    def _complete(self, prefix: str) -> list[str]:
+        node = self.trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        return self._subtree(node)
+
+    def _fuzzy_complete(self, token: str) -> dict[str, int]:
+        """Tokens with a prefix within the edit budget of `token` -> smallest such distance."""
+        budget = allowed_edits(token)
+        first = self.trie.get(token[0]) if token else None
+        if not budget or first is None:
+            return {}
+        matches: dict[str, int] = {}
+        # Rows of the (optimal string alignment) distance between `token` and the trie path so far
+        root_row = list(range(len(token) + 1))
+        stack = [(first, token[0], None, root_row, None)]
+        while stack:
+            node, char, previous_char, previous, previous2 = stack.pop()
+            row = [previous[0] + 1]
+            for j in range(1, len(token) + 1):
+                cost = 0 if token[j - 1] == char else 1
+                row.append(min(previous[j] + 1, row[j - 1] + 1, previous[j - 1] + cost))
+                if previous2 is not None and j > 1 and token[j - 1] == previous_char and token[j - 2] == char:
+                    row[j] = min(row[j], previous2[j - 2] + 1)
+            if row[-1] <= budget:
+                for match in self._subtree(node):
+                    matches[match] = min(matches.get(match, budget), row[-1])
+            if min(row) > budget:
+                continue
+            for key, child in node.items():
+                if key != _END:
+                    stack.append((child, key, char, row, previous))
+        return matches
+
+    def _subtree(self, node: dict) -> list[str]:
+        found, stack = [], [node]
+        while stack and len(found) < PREFIX_CANDIDATES:
+            node = stack.pop()
+            for key, child in node.items():
+                if key == _END:
+                    found.append(child)
+                else:
+                    stack.append(child)
+        return found
+
+    def _fuzzy(self, token: str) -> dict[str, int]:
+        budget = allowed_edits(token)
+        if not budget:
+            return {}
+        candidates = set()
+        for variant in deletes(token, budget):
+            candidates |= self.variants.get(variant, set())
+        matches = {}
+        for candidate in candidates:
+            if candidate[0] != token[0]:
+                continue
+            distance = edit_distance(token, candidate, budget)
+            if distance <= min(budget, allowed_edits(candidate)):
+                matches[candidate] = distance
+        return matches
+
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        """Rank tag names against a query: exact word > word prefix > typo match > typo prefix, summed over query words."""
+        scores: dict[str, float] = {}
+        for token in tokenize(query):
+            token_scores: dict[str, float] = {}
+            for match in self._complete(token):
+                # Exact word beats completion; shorter completions are closer to what was typed
+                score = 3.0 if match == token else 2.0 + len(token) / len(match) * 0.5
+                token_scores[match] = max(token_scores.get(match, 0), score)
+            for match, distance in self._fuzzy_complete(token).items():
+                token_scores[match] = max(token_scores.get(match, 0), 1.2 / (1 + distance))
+            for match, distance in self._fuzzy(token).items():
+                token_scores[match] = max(token_scores.get(match, 0), 1.5 / (1 + distance))
+            per_tag: dict[str, float] = {}
+            for match, score in token_scores.items():
+                for name in self.token_tags.get(match, ()):
+                    per_tag[name] = max(per_tag.get(name, 0), score)
+            for name, score in per_tag.items():
+                scores[name] = scores.get(name, 0) + score
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], len(item[0]), item[0]))
+        return [{"name": name, "score": round(score, 4)} for name, score in ranked[:limit]]
+
+
+class LocalTagSearch(LazyUserIndexes):
+    """Per-user LexicalTagIndex instances, loaded lazily and kept in sync with tag writes."""
+
+    def __init__(self, max_users: int = TAG_INDEX_USERS):
+        super().__init__(max_users)
+        self.counters["searches"] = 0
+
+    async def _load(self, user_id: str) -> LexicalTagIndex:
+        docs = await tags_collection.find({"user_id": user_id}, {"name": 1, "_id": 0}).to_list(length=None)
+        return await asyncio.to_thread(LexicalTagIndex, [d["name"] for d in docs])
+
+    async def search(self, user_id: str, query: str, limit: int = 10) -> list[dict]:
+        self.counters["searches"] += 1
+        return (await self.get(user_id)).search(query, limit)
+
+    def tags_added(self, user_id: str, names: list[str], version: int | None = None):
+        def add(index: LexicalTagIndex):
+            for name in names:
+                index.add(name)
+        self._apply(user_id, add, version)
+
+    def tag_removed(self, user_id: str, name: str, version: int | None = None):
+        self._apply(user_id, lambda index: index.remove(name), version)
+
+    def stats(self) -> dict:
+        return {**self.counters, "users_loaded": len(self._users), "tags": sum(len(i) for i in self._users.values())}
+
+
+local_tag_search = LocalTagSearch()
@@ -0,0 +1,89 @@
+from app.dependency import posts_collection
+from app.actions.vector_index import local_vector_search
+from app.actions.lazy_index import LazyUserIndexes
+from dotenv import load_dotenv
+import numpy as np
+import os
+
+load_dotenv()
+
+TAG_PROMPT_TOP_K = int(os.getenv("TAG_PROMPT_TOP_K", "40"))
+TAG_VOCABULARY_USERS = int(os.getenv("TAG_VOCABULARY_USERS", "500"))
+
+
+class TagVocabularyCache(LazyUserIndexes):
+    """Per-user tag vocabulary used to build the Gemini tagging prompt.
+
+    Instead of pasting every tag a user ever had into the prompt, `select`
+    returns a bounded top-K: the tags closest to the caption by embedding
+    similarity (via the local vector index), or the most used tags when
+    there is no caption. Usage counts are cached per user and bumped in
+    place as posts gain or lose tags. They only rank tags, so a write
+    replayed onto a load that already saw it may count twice until the next
+    reload.
+    """
+
+    def __init__(self, max_users: int = TAG_VOCABULARY_USERS):
+        super().__init__(max_users)
+        self.counters.update(prompts=0, tags_sent=0, tags_available=0)
+
+    async def _load(self, user_id: str) -> dict[str, int]:
+        rows = await (await posts_collection.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$project": {"tag_names": 1}},
+            {"$unwind": "$tag_names"},
+            {"$group": {"_id": "$tag_names", "count": {"$sum": 1}}}
+        ])).to_list(length=None)
+        return {r["_id"]: r["count"] for r in rows}
+
+    async def usage(self, user_id: str) -> dict[str, int]:
+        """How many of the user's posts carry each tag."""
+        return await self.get(user_id)
+
+    async def select(self, user_id: str, caption: str | None, embed, k: int = TAG_PROMPT_TOP_K) -> list[str]:
+        """Pick at most k existing tags worth showing Gemini for a new image.
+
+        `embed` is the async text-embedding function used for the caption.
+        """
+        index = await local_vector_search.get(user_id)
+        if len(index) <= k:
+            selected = list(index.names)
+        elif caption and caption.strip():
+            query = (await embed([caption.strip()]))[0]
+            selected = [name for name, _ in index.search(np.asarray(query), k)]
+        else:
+            counts = await self.usage(user_id)
+            # Most used first; among equals, the most recently added
+            ranked = sorted(enumerate(index.names), key=lambda p: (counts.get(p[1], 0), p[0]), reverse=True)
+            selected = [name for _, name in ranked[:k]]
+        self.counters["prompts"] += 1
+        self.counters["tags_sent"] += len(selected)
+        self.counters["tags_available"] += len(index)
+        return selected
+
+    def tags_added(self, user_id: str, names: list[str], version: int | None = None):
+        """`names` were added to one post."""
+        def add(counts: dict[str, int]):
+            for name in names:
+                counts[name] = counts.get(name, 0) + 1
+        self._apply(user_id, add, version)
+
+    def tags_removed(self, user_id: str, names: list[str], version: int | None = None):
+        """`names` were taken off one post (or the post was deleted)."""
+        def remove(counts: dict[str, int]):
+            for name in names:
+                if counts.get(name, 0) > 1:
+                    counts[name] -= 1
+                else:
+                    counts.pop(name, None)
+        self._apply(user_id, remove, version)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "users_cached": len(self._users),
+            "prompt_tag_ratio": round(self.counters["tags_sent"] / self.counters["tags_available"], 4) if self.counters["tags_available"] else 0.0,
+        }
+
+
+tag_vocabulary_cache = TagVocabularyCache()
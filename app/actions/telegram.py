@@ -1,21 +1,21 @@
-import aiohttp
 import asyncio
 import logging
+from app.actions.telegram_client import TelegramClient, telegram_client
 
 class TelegramFilePathFetcher:
     def __init__(self, bot_token,user_id):
-        self.url = f"https://api.telegram.org/bot{bot_token}/"
+        # Reuse the app-wide pooled client unless a different bot token is given
+        self.client = telegram_client if bot_token == telegram_client.token else TelegramClient(bot_token)
         self.file_id_array = []
         self.user_id = user_id
 
     async def fetch_json(self, endpoint):
         """Helper function to fetch JSON data from a Telegram API endpoint."""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.url + endpoint) as response:
-                    if response.status != 200:
-                        raise Exception(f"Response status: {response.status}")
-                    return await response.json()
+            response = await self.client.call(endpoint)
+            if response["status"] != 200:
+                raise Exception(f"Response status: {response['status']}")
+            return response
         except Exception as error:
             print(f"Error fetching {endpoint}: {error}")
             return {}
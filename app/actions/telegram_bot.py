@@ -1,10 +1,27 @@
 from telegram import Bot
 from dotenv import load_dotenv
-from app.dependency import users_collection, posts_collection,tags_collection, client, mongoClient
+from app.dependency import users_collection, posts_collection,tags_collection, mongoClient
+from app.actions.http_client import get_session
+from app.actions.telegram_client import telegram_client
+from app.actions.gemini import generate_content
+from app.actions.tag_vocabulary import tag_vocabulary_cache
+from app.actions.vector_index import local_vector_search
+from app.actions.tag_index import local_tag_search
+from app.actions.post_index import post_tag_index
+from app.actions.lazy_index import user_written
+from app.actions.user_cache import user_cache
+from app.actions.user_counters import increment
+from app.actions.file_paths import file_path_index
+from app.actions.boolean_query import expand_case, query_tags, to_mongo_filter
+from app.actions.embeddings import generate_embeddings_async
+from app.actions.image_cache import image_cache, image_cache_key
+from app.actions.pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_filter
+from app.actions.latency import StageTimer
+from app.actions.streaming import STREAM_BATCH_SIZE
 from app.schemas.users import User, Membership, PreviousPlan, PlanType
 from app.schemas.posts import Post, FILE_TYPE, ResolutionDetails, FileDetails
 from bson import ObjectId
-from pymongo import UpdateOne
+from pymongo import ReturnDocument, UpdateOne
 from pymongo.errors import PyMongoError
 from google.genai import types
 import mimetypes, requests, json, aiohttp, asyncio, magic, os, base64
@@ -12,6 +29,13 @@ from datetime import datetime, timedelta
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_API")
+GEMINI_TAG_MODEL = os.getenv("GEMINI_TAG_MODEL", "gemini-2.0-flash")
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "atlas")  # "atlas" or "local"
+TAG_SEARCH_BACKEND = os.getenv("TAG_SEARCH_BACKEND", "atlas")  # "atlas" or "local"
+SEARCH_RANKING = os.getenv("SEARCH_RANKING", "hybrid")  # "hybrid" or "semantic" for premium users
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")  # "rrf" or "weighted"
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_SEMANTIC_WEIGHT = float(os.getenv("HYBRID_SEMANTIC_WEIGHT", "0.5"))
 TELE_FILE_URL = os.getenv("TELE_FILE_URL")
 bot = Bot(BOT_TOKEN)
 
@@ -19,28 +43,24 @@ TELE_FILE_BASE_URL = f"https://api.telegram.org/file/bot{BOT_TOKEN}/"
 
 
 async def run_tele_api(endpoint, params=None, method='get'):
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/{endpoint}"
-    async with aiohttp.ClientSession() as session:
-        if method.lower() == 'get':
-            async with session.get(url, params=params) as response:
-                data = await response.json()
-                return {"ok": response.status == 200, "status": response.status, **data}
-        elif method.lower() == 'post':
-            async with session.post(url, json=params) as response:
-                data = await response.json()
-                return {"ok": response.status == 200, "status": response.status, **data}
+    """Call a Telegram Bot API method through the shared, rate-limited client."""
+    return await telegram_client.call(endpoint, params=params, method=method)
 
 
 
-async def get_file_path(file_id, message_id = None, chat_id = None, resolution = None, user_id = None):
-    """Fetch the file path for a given file ID."""
+async def resolve_file(file_id, message_id = None, chat_id = None, resolution = None):
+    """Return (file_id, file_path) for a file.
+
+    If the file_id no longer works and the original message is known, the
+    message is forwarded to obtain a fresh file_id; the forwarded copy is
+    deleted again so it doesn't clutter the user's chat.
+    """
     response = await run_tele_api(f"getFile?file_id={file_id}")
     if response["ok"]:
-        file_path = response.get("result", {}).get("file_path", "")
-        return file_path
+        return file_id, response.get("result", {}).get("file_path", "")
     
-    if not (message_id and chat_id and resolution and user_id):
-        return None
+    if not (message_id and chat_id and resolution):
+        return file_id, None
     # If not ok, re-send message to user to get fresh file_id
     resend = await run_tele_api("forwardMessage", {
         "chat_id": int(chat_id),
@@ -50,6 +70,10 @@ async def get_file_path(file_id, message_id = None, chat_id = None, resolution =
 
     if not resend.get("ok"):
         raise Exception("Failed to resend message to fetch new file_id", resend)
+
+    forwarded_id = resend.get("result", {}).get("message_id")
+    if forwarded_id:
+        await run_tele_api("deleteMessage", {"chat_id": int(chat_id), "message_id": forwarded_id}, method="post")
     
     photo_array = resend.get("result", {}).get("photo", [{}])
     new_file_id = ""
@@ -60,20 +84,43 @@ async def get_file_path(file_id, message_id = None, chat_id = None, resolution =
         new_file_id = photo_array[-2].get("file_id") if len(photo_array) > 1 else photo_array[-1].get("file_id")
 
     response = await run_tele_api(f"getFile?file_id={new_file_id}")
-    if response["ok"]:
-        new_file_path = response.get("result", {}).get("file_path", "")
-    
-    await posts_collection.update_one(
-        {"user_id": user_id, "message_id": message_id},
-        {
-            "$set": {
-                f"file_details.{resolution}.file_id": new_file_id,
-                f"file_details.{resolution}.file_path": new_file_path
-            }
-        }
-    )    
-    
-    return new_file_path    
+    if not response["ok"]:
+        return new_file_id, None
+    return new_file_id, response.get("result", {}).get("file_path", "")
+
+async def get_file_path(file_id, message_id = None, chat_id = None, resolution = None):
+    """Fetch the file path for a given file ID."""
+    _, file_path = await resolve_file(file_id, message_id=message_id, chat_id=chat_id, resolution=resolution)
+    return file_path
+
+async def refresh_post_file_path(post: dict):
+    """Re-issue the file path of a post's file and persist it with a single write.
+
+    `post` is a fetch_file_identity result. Returns the new path, or None if
+    Telegram could not provide one.
+    """
+    profile = await user_cache.get(post.get("user_id"))
+    if not profile:
+        return None
+
+    resolution = post.get("resolution")
+    file_id, file_path = await resolve_file(
+        post.get("file_id"),
+        message_id=post.get("message_id"),
+        chat_id=profile.chat_id,
+        resolution=resolution
+    )
+    if not file_path:
+        return None
+
+    update = {f"file_details.{resolution}.file_path": file_path}
+    if file_id != post.get("file_id"):
+        update[f"file_details.{resolution}.file_id"] = file_id
+    await posts_collection.update_one({"_id": post["_id"]}, {"$set": update})
+    await file_path_index.record(file_path, post["_id"], resolution, post.get("user_id"))
+    image_cache.alias(file_path, post["cache_key"], current=True)
+    post["file_id"], post["file_path"] = file_id, file_path
+    return file_path
     
 
 def serialize_doc(doc):
@@ -112,7 +159,7 @@ async def send_msg(text: str, chat_id: str, error: bool = True):
 async def handle_new_user(user: dict, chat_id: str):
     """Register a new user if they don't exist."""
     user_id = str(user.get("id"))
-    existing_user = await users_collection.find_one({"user_id": user_id})
+    existing_user = await user_cache.get(user_id)
     if existing_user:
         await send_msg(text="User already exists", chat_id=chat_id, error=False)
 
@@ -147,6 +194,7 @@ async def handle_new_user(user: dict, chat_id: str):
         {"$setOnInsert": user_data.model_dump()},
         upsert=True
     )
+    user_cache.invalidate(user_id)
 
     print(f"New user added: {user_data.username}")
     await send_msg(text=f"New User {user_data.username} added", chat_id=chat_id, error=False)
@@ -170,7 +218,7 @@ async def extract_photo_details(photo_list: list) -> ResolutionDetails:
     for p in photo_list:
         file_id = p["file_id"]
         file_path = await get_file_path(file_id)
-        file_details.append(FileDetails(file_id=file_id, file_path=file_path))
+        file_details.append(FileDetails(file_id=file_id, file_path=file_path, file_unique_id=p.get("file_unique_id")))
 
     # Assign based on available count
     if len(file_details) == 1:
@@ -188,16 +236,20 @@ async def save_post(user_id: str, message_id: str, caption: str, file_details: R
         message_id=message_id,
     )
 
-    post_id = (await posts_collection.insert_one(post_data.model_dump())).inserted_id
-    await users_collection.update_one(
-        {"user_id": user_id},
-        {"$addToSet": {"posts": post_id}}
-    )
+    post_doc = post_data.model_dump()
+    post_id = (await posts_collection.insert_one(post_doc)).inserted_id
+    await file_path_index.record_post(post_id, user_id, post_doc["file_details"])
+    stats = await increment(user_id, posts=1)
+    if stats:
+        user_cache.set_post_count(user_id, stats["posts"])
+    version = (stats or {}).get("version")
+    post_tag_index.post_added(user_id, post_id, version)
+    user_written(user_id, version)
     print(f"Post saved: {post_id}")
     await send_msg(text=f"New Post {post_id} added", chat_id=chat_id, error=False)
     return post_id
 
-async def generate_tags(mime_type: str, data: bytes, user_id: str):
+async def generate_tags(mime_type: str, data: bytes, user_id: str, caption: str = ""):
     """
     Generate tags for the provided media content.
     
@@ -205,10 +257,12 @@ async def generate_tags(mime_type: str, data: bytes, user_id: str):
         mime_type (str): The MIME type of the media content.
         data (bytes): The media content data.
         user_id (str): The ID of the user submitting the content.
+        caption (str): The post caption, used to pick relevant existing tags for the prompt.
 
     """
     
-    tag_names = await tags_collection.distinct("name", {"user_id": user_id})
+    # Only a bounded, relevant subset of the user's existing tags goes into the prompt
+    tag_names = await tag_vocabulary_cache.select(user_id, caption, generate_embeddings_async)
 
     text = """
         Analyze the provided image or video and return only a JSON array containing up to 7 unique, high-relevance tags that best describe it for casual user search.
@@ -232,8 +286,8 @@ async def generate_tags(mime_type: str, data: bytes, user_id: str):
         response_mime_type="application/json"
     )
     
-    response  = client.models.generate_content(
-        model="gemini-2.0-flash",
+    response = await generate_content(
+        model=GEMINI_TAG_MODEL,
         contents=[
             types.Part.from_bytes(
                 data=data,
@@ -257,28 +311,7 @@ async def generate_tags(mime_type: str, data: bytes, user_id: str):
     # tags_list = json.loads(text_value)
     return res_dict
 
-from fastembed import TextEmbedding
-from concurrent.futures import ThreadPoolExecutor
-from pymongo import UpdateOne
 from typing import List
-from datetime import datetime
-import asyncio
-
-# Initialize once (global)
-embedding_model = TextEmbedding(model_name="BAAI/bge-small-en-v1.5")
-executor = ThreadPoolExecutor(max_workers=4)
-
-async def generate_embeddings_async(texts: List[str]) -> List[List[float]]:
-    """Generate embeddings asynchronously using FastEmbed"""
-    loop = asyncio.get_event_loop()
-    
-    # Run in thread pool to avoid blocking event loop
-    embeddings = await loop.run_in_executor(
-        executor,
-        lambda: list(embedding_model.embed(texts))
-    )
-    
-    return embeddings
 
 async def save_tags_and_update_post(tags_list: list[str], user_id: str, post_id: ObjectId):
     """Save tags with embeddings using upsert to avoid race conditions."""
@@ -310,13 +343,24 @@ async def save_tags_and_update_post(tags_list: list[str], user_id: str, post_id:
     
     # Run both operations concurrently
     try:
-        await asyncio.gather(
+        tags_result, post_before = await asyncio.gather(
             tags_collection.bulk_write(operations, ordered=False),
-            posts_collection.update_one(
+            posts_collection.find_one_and_update(
                 {"_id": post_id},
-                {"$addToSet": {"tag_names": {"$each": tags_list}}}
+                {"$addToSet": {"tag_names": {"$each": tags_list}}},
+                projection={"tag_names": 1},
+                return_document=ReturnDocument.BEFORE
             )
         )
+        newly_tagged = post_before is not None and not post_before.get("tag_names")
+        stats = await increment(user_id, tags=tags_result.upserted_count, tagged_posts=int(newly_tagged))
+        version = (stats or {}).get("version")
+        previous_tags = set((post_before or {}).get("tag_names") or [])
+        tag_vocabulary_cache.tags_added(user_id, [t for t in tags_list if t not in previous_tags], version)
+        local_vector_search.tags_added(user_id, tags_list, embeddings, version)
+        local_tag_search.tags_added(user_id, tags_list, version)
+        post_tag_index.tags_added(user_id, post_id, tags_list, version)
+        user_written(user_id, version)
         return True
     except Exception as e:
         print(f"Error saving tags: {e}")
@@ -326,43 +370,152 @@ async def save_tags_and_update_post(tags_list: list[str], user_id: str, post_id:
 #     return save_tags_and_update_post(tags_list=["cake", "dessert", "sweet"], user_id="1892630283", post_id=ObjectId("656f1f4e8f1b2c3d4e5f6789"))
 
 
-def fetch_mime_type(b64_data, file_path) -> str:
-    """Fetch the MIME type from base64-encoded bytes using python-magic."""
+MIME_SNIFF_BYTES = 512
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+
+def fetch_mime_type(head: bytes, file_path) -> str:
+    """Fetch the MIME type from the file extension, falling back to sniffing the leading raw bytes."""
     mime_type, _ = mimetypes.guess_type(file_path)
     if mime_type:
         return mime_type
-    raw_bytes = base64.b64decode(b64_data)
     mime = magic.Magic(mime=True)
-    return mime.from_buffer(raw_bytes)
+    return mime.from_buffer(head[:MIME_SNIFF_BYTES])
 
 async def get_image(file_path: str):
-    """Return an image from a file path."""
+    """Return the full bytes of an image from a file path."""
     try:
         url = f"{TELE_FILE_URL}{file_path}"
-        response = requests.get(url, timeout=10)
-        
-        if response.status_code == 200:
-            base64_bytes = base64.b64encode(response.content).decode("utf-8")
-            mimetype = fetch_mime_type(base64_bytes, file_path)
+        async with get_session().get(url) as response:
+            if response.status != 200:
+                return {"ok": False, "error": f"HTTP {response.status}"}
+            content = await response.read()
             return {
                 "ok": True,
-                "content": response.content,
-                "media_type": mimetype
+                "content": content,
+                "media_type": fetch_mime_type(content, file_path)
             }
-        else:
-            return {"ok": False, "error": f"HTTP {response.status_code}"}
     except Exception as e:
         return {"ok": False, "error": str(e)}
+
+async def open_image_stream(file_path: str, range_header: str | None = None):
+    """Open a streaming download of an image from a file path.
+
+    Only the first MIME_SNIFF_BYTES are read up front (for MIME detection), the
+    rest is passed through in IMAGE_CHUNK_SIZE chunks by the returned "body"
+    iterator, so memory per request stays bounded regardless of image size.
+    A Range header is forwarded upstream; "status" is 206 when it was honoured.
+    """
+    url = f"{TELE_FILE_URL}{file_path}"
+    headers = {"Range": range_header} if range_header else None
+    try:
+        response = await get_session().get(url, headers=headers)
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+    if response.status not in (200, 206):
+        response.release()
+        return {"ok": False, "status": response.status, "error": f"HTTP {response.status}"}
+
+    head = b""
+    try:
+        while len(head) < MIME_SNIFF_BYTES:
+            chunk = await response.content.read(MIME_SNIFF_BYTES - len(head))
+            if not chunk:
+                break
+            head += chunk
+    except Exception as e:
+        response.release()
+        return {"ok": False, "error": str(e)}
+
+    async def body():
+        try:
+            if head:
+                yield head
+            async for chunk in response.content.iter_chunked(IMAGE_CHUNK_SIZE):
+                yield chunk
+        finally:
+            response.release()
+
+    return {
+        "ok": True,
+        "status": response.status,
+        "media_type": fetch_mime_type(head, file_path),
+        "content_length": response.content_length,
+        "content_range": response.headers.get("Content-Range"),
+        "body": body()
+    }
+
+async def head_image(file_path: str):
+    """Check an image upstream with a HEAD request, returning its size and type without the body."""
+    try:
+        url = f"{TELE_FILE_URL}{file_path}"
+        async with get_session().head(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+            if response.status != 200:
+                return {"ok": False, "status": response.status, "error": f"HTTP {response.status}"}
+            mime_type, _ = mimetypes.guess_type(file_path)
+            return {
+                "ok": True,
+                "media_type": mime_type or response.content_type,
+                "content_length": response.content_length
+            }
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+def cache_image_stream(image: dict, key: str, last_modified: float | None = None, file_path: str | None = None) -> dict:
+    """Wrap an open_image_stream result so the bytes are stored in the image cache as they pass through.
+
+    Bytes are only buffered up to the cache's max entry size; larger images
+    and partial (ranged) responses are streamed through without being kept.
+    """
+    if image.get("status") != 200:
+        return image
+    upstream = image["body"]
+
+    async def body():
+        chunks, size = [], 0
+        async for chunk in upstream:
+            if chunks is not None:
+                size += len(chunk)
+                if size <= image_cache.max_entry_bytes:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+            yield chunk
+        if chunks is not None:
+            await image_cache.put(key, b"".join(chunks), image["media_type"], last_modified, file_path)
+
+    return {**image, "body": body()}
+
+async def fetch_file_identity(file_path: str):
+    """Find the post a file path belongs to and the stable identity of that file.
+
+    Stale paths resolve too; `file_path` in the result is the file's current path.
+    Returns None if no post references the path.
+    """
+    identity = await file_path_index.resolve(file_path)
+    if identity is None:
+        return None
+    resolution = identity["resolution"]
+    post = await posts_collection.find_one(
+        {"_id": identity["post_id"]},
+        {"user_id": 1, "message_id": 1, "created_at": 1, f"file_details.{resolution}": 1}
+    )
+    if not post:
+        return None
+    details = (post.pop("file_details", None) or {}).get(resolution) or {}
+    post["resolution"] = resolution
+    post["file_id"] = details.get("file_id")
+    post["file_unique_id"] = details.get("file_unique_id")
+    post["file_path"] = details.get("file_path") or file_path
+    post["cache_key"] = image_cache_key(post.get("file_unique_id"), post["_id"], resolution)
+    return post
     
 async def fetch_post_from_file_path(file_path: str):
-    """Fetch post details from the database using the file path."""
+    """Fetch post details from the database using the file path (current or previously issued)."""
     try:
-        post = await posts_collection.find_one({
-            "$or": [
-                {"file_details.high.file_path": file_path},
-                {"file_details.medium.file_path": file_path}
-            ]
-        })
+        identity = await file_path_index.resolve(file_path)
+        post = await posts_collection.find_one({"_id": identity["post_id"]}) if identity else None
         if post:
             return {"ok": True, "post": post}
         else:
@@ -370,6 +523,13 @@ async def fetch_post_from_file_path(file_path: str):
     except Exception as e:
         return {"ok": False, "message": str(e)}
     
+async def resolve_post_ids(file_paths: list[str]) -> tuple[list, list[str]]:
+    """Post ids for a list of file paths, in input order (duplicates dropped), plus every path that matched no post."""
+    identities = await file_path_index.resolve_many(file_paths)
+    post_ids = list(dict.fromkeys(identities[p]["post_id"] for p in file_paths if p in identities))
+    missing = [p for p in dict.fromkeys(file_paths) if p not in identities]
+    return post_ids, missing
+
 from pymongo.errors import PyMongoError
 from bson import ObjectId
 
@@ -387,7 +547,7 @@ async def remove_tag_from_post(name: str, file_path: str, user_id: str):
     session = await mongoClient.start_session()
     try:
         await session.start_transaction()
-        tag_doc = await tags_collection.find_one({"name": name}, session=session)
+        tag_doc = await tags_collection.find_one({"name": name, "user_id": user_id}, session=session)
         if not tag_doc:
             await session.abort_transaction()
             return {"ok": False, "message": "Tag not found"}
@@ -398,18 +558,31 @@ async def remove_tag_from_post(name: str, file_path: str, user_id: str):
             return {"ok": False, "message": "Post not found"}
 
         post = post_res["post"]
-        await posts_collection.update_one(
+        post_before = await posts_collection.find_one_and_update(
             {"_id": post["_id"]},
             {"$pull": {"tag_names": name}},
+            projection={"tag_names": 1},
             session=session
         )
         # Check is any other posts have this tag for the same user
         other_post_with_tag = await posts_collection.find_one({"tag_names":name, "user_id":user_id}, session=session)
+        tags_deleted = 0
         if not other_post_with_tag:
             # If no other posts have this tag, remove it from tags_collection
-            await tags_collection.delete_one({"_id": tag_doc["_id"]}, session=session)
+            tags_deleted = (await tags_collection.delete_one({"_id": tag_doc["_id"]}, session=session)).deleted_count
+        previous_tags = (post_before or {}).get("tag_names") or []
+        untagged = previous_tags == [name]
+        stats = await increment(user_id, session=session, tags=-tags_deleted, tagged_posts=-int(untagged))
+        version = (stats or {}).get("version")
             
         await session.commit_transaction()
+        if name in previous_tags:
+            tag_vocabulary_cache.tags_removed(user_id, [name], version)
+        post_tag_index.tag_removed(user_id, post["_id"], name, version)
+        if not other_post_with_tag:
+            local_vector_search.tag_removed(user_id, name, version)
+            local_tag_search.tag_removed(user_id, name, version)
+        user_written(user_id, version)
         return {"ok": True, "message": "Tag removed from post"}
 
     except PyMongoError as e:
@@ -423,8 +596,8 @@ async def verify_image_path(file_path: str) -> bool:
     """Check if image URL is still valid without downloading full content"""
     try:
         url = f"{TELE_FILE_URL}{file_path}"
-        response = requests.head(url, timeout=5)  # HEAD request is faster
-        return response.status_code == 200
+        async with get_session().head(url, timeout=aiohttp.ClientTimeout(total=5)) as response:  # HEAD request is faster
+            return response.status == 200
     except:
         return False
 
@@ -480,6 +653,7 @@ async def upgrade_plan(user_id: str, plan_type: PlanType):
             {"user_id": str(user_id)},
             {"$set": {"membership": updated_membership.model_dump()}}
         )
+        user_cache.invalidate(user_id)
         
         print(updated_user.matched_count, updated_user.modified_count)
         return {"ok": True, "message": "Membership upgraded successfully"}
@@ -489,141 +663,340 @@ async def upgrade_plan(user_id: str, plan_type: PlanType):
     
 async def is_premium_user(user_id:str) -> bool:
     """Check if the user has an active premium membership."""
-    user_doc = await users_collection.find_one({"user_id": str(user_id)})
-    if not user_doc:
-        return False
-    membership = user_doc.get("membership")
-    if not membership:
-        return False
-    expires_at = membership.get("expires_at")
+    profile = await user_cache.get(user_id)
+    return bool(profile and profile.is_premium)
 
-    if not expires_at:
-        return False
-
-    # Ensure expires_at is a datetime object
-    if isinstance(expires_at, str):
-        expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
+async def search_tags_atlas_text(query: str, user_id: str, limit: int = 10) -> List[dict]:
+    """Autocomplete with typo tolerance from the Atlas Search index `tag_search`."""
+    pipeline = [
+        {
+            "$search": {
+                "index": "tag_search",
+                "compound": {
+                    "must": [
+                        {
+                            "autocomplete": {
+                                "query": query,
+                                "path": "name",
+                                "fuzzy": {
+                                    "maxEdits": 2,  # Allow up to 2 typos
+                                    "prefixLength": 1  # First character must match
+                                }
+                            }
+                        }
+                    ],
+                    "filter": [
+                        {
+                            "equals": {
+                                "path": "user_id",
+                                "value": user_id
+                            }
+                        }
+                    ]
+                }
+            }
+        },
+        {"$limit": limit},
+        {
+            "$project": {
+                "name": 1,
+                "score": {"$meta": "searchScore"},
+                "_id": 0
+            }
+        }
+    ]
 
-    return datetime.now() < expires_at
+    cursor = await tags_collection.aggregate(pipeline)
+    return await cursor.to_list(length=limit)
 
 async def search_tags_standard(query: str, user_id: str, limit: int = 10) -> List[dict]:
     """
     Standard text search with autocomplete and typo tolerance.
-    Uses Atlas Search with fallback to regex.
+    Uses Atlas Search, or the in-process lexical tag index when TAG_SEARCH_BACKEND=local
+    or Atlas Search is unavailable or finds nothing.
     """
+    if TAG_SEARCH_BACKEND != "local":
+        try:
+            tags = await search_tags_atlas_text(query, user_id, limit)
+            if tags:
+                return tags
+        except PyMongoError as e:
+            print(f"Atlas Search unavailable ({e}), using local tag index")
     try:
-        # Try Atlas Search first
-        pipeline = [
-            {
-                "$search": {
-                    "index": "tag_search",
-                    "compound": {
-                        "must": [
-                            {
-                                "autocomplete": {
-                                    "query": query,
-                                    "path": "name",
-                                    "fuzzy": {
-                                        "maxEdits": 2,  # Allow up to 2 typos
-                                        "prefixLength": 1  # First character must match
-                                    }
-                                }
-                            }
-                        ],
-                        "filter": [
-                            {
-                                "equals": {
-                                    "path": "user_id",
-                                    "value": user_id
-                                }
-                            }
-                        ]
-                    }
-                }
-            },
-            {"$limit": limit},
-            {
-                "$project": {
-                    "name": 1,
-                    "score": {"$meta": "searchScore"},
-                    "_id": 0
-                }
-            }
-        ]
-        
-        cursor = tags_collection.aggregate(pipeline)
-        tags = await cursor.to_list(length=limit)
-        
-        # Fallback to regex if Atlas Search returns nothing
-        if not tags:
-            print(f"Atlas Search returned nothing, using regex fallback for query: {query}")
-            tags = await tags_collection.find(
-                {
-                    "name": {"$regex": query, "$options": "i"},
-                    "user_id": user_id
-                },
-                {"name": 1, "_id": 0}
-            ).limit(limit).to_list(length=limit)
-        
-        return tags
-    
+        return await local_tag_search.search(user_id, query, limit)
     except Exception as e:
-        print(f"Standard search error: {e}, falling back to regex")
-        # Final fallback to regex
-        try:
-            tags = await tags_collection.find(
-                {
-                    "name": {"$regex": query, "$options": "i"},
-                    "user_id": user_id
-                },
-                {"name": 1, "_id": 0}
-            ).limit(limit).to_list(length=limit)
-            return tags
-        except Exception as fallback_error:
-            print(f"Regex fallback also failed: {fallback_error}")
-            return []
+        print(f"Local tag search failed: {e}")
+        return []
 
 
 # ==================== SEMANTIC SEARCH (PREMIUM) ====================
 
+async def search_tags_atlas_vector(query_embedding: list, user_id: str, limit: int = 10) -> List[dict]:
+    """Top-k tags from the Atlas $vectorSearch index `vector_index`."""
+    pipeline = [
+        {
+            "$vectorSearch": {
+                "index": "vector_index",  # Atlas Vector Search index
+                "path": "embedding",
+                "queryVector": query_embedding,
+                "numCandidates": 100,  # Number of candidates to consider
+                "limit": limit,
+                "filter": {"user_id": {"$eq": user_id}}
+            }
+        },
+        {
+            "$project": {
+                "name": 1,
+                "score": {"$meta": "vectorSearchScore"},
+                "_id": 0
+            }
+        }
+    ]
+    
+    cursor = await tags_collection.aggregate(pipeline)
+    return await cursor.to_list(length=limit)
+
+async def search_tags_vector(query: str, user_id: str, limit: int = 10) -> List[dict]:
+    """
+    Nearest tags to the query embedding, via Atlas Vector Search or the in-process vector
+    index (VECTOR_SEARCH_BACKEND=local, or when Atlas is unavailable or finds nothing).
+    """
+    query_embedding = (await generate_embeddings_async([query]))[0]
+    if VECTOR_SEARCH_BACKEND == "local":
+        return await local_vector_search.search(user_id, query_embedding, limit)
+    try:
+        tags = await search_tags_atlas_vector(query_embedding.tolist(), user_id, limit)
+        if tags:
+            return tags
+    except PyMongoError as e:
+        print(f"Atlas vector search unavailable ({e}), using local vector index")
+    return await local_vector_search.search(user_id, query_embedding, limit)
+
 async def search_tags_semantic(query: str, user_id: str, limit: int = 10) -> List[dict]:
     """
     Semantic search using AI embeddings.
     Finds tags with similar meaning, not just keyword matches.
     """
     try:
-        # Generate embedding for the search query
-        query_embeddings = await generate_embeddings_async([query])
-        query_embedding = query_embeddings[0].tolist()
-        
-        # Vector search pipeline
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "index": "vector_index",  # Atlas Vector Search index
-                    "path": "embedding",
-                    "queryVector": query_embedding,
-                    "numCandidates": 100,  # Number of candidates to consider
-                    "limit": limit,
-                    "filter": {"user_id": {"$eq": user_id}}
-                }
-            },
-            {
-                "$project": {
-                    "name": 1,
-                    "score": {"$meta": "vectorSearchScore"},
-                    "_id": 0
-                }
-            }
-        ]
-        
-        cursor = tags_collection.aggregate(pipeline)
-        tags = await cursor.to_list(length=limit)
-        
-        return tags
-    
+        return await search_tags_vector(query, user_id, limit)
     except Exception as e:
         print(f"Semantic search error: {e}")
         # Fallback to standard search if semantic fails
         print("Falling back to standard search...")
-        return await search_tags_standard(query, user_id, limit)
\ No newline at end of file
+        return await search_tags_standard(query, user_id, limit)
+
+def fuse_tag_rankings(lexical: List[dict], semantic: List[dict], limit: int = 10) -> List[dict]:
+    """
+    Merge lexical and semantic tag results into one ranking.
+
+    "rrf" (reciprocal-rank fusion) scores a tag by sum(1 / (HYBRID_RRF_K + rank)) over the
+    lists it appears in, so the two incomparable score scales never meet. "weighted" scales
+    each list by its best score and mixes them with HYBRID_SEMANTIC_WEIGHT.
+    """
+    fused: dict[str, float] = {}
+    for results, weight in ((lexical, 1 - HYBRID_SEMANTIC_WEIGHT), (semantic, HYBRID_SEMANTIC_WEIGHT)):
+        if HYBRID_FUSION == "weighted":
+            best = max((t.get("score") or 0 for t in results), default=0) or 1.0
+            for t in results:
+                fused[t["name"]] = fused.get(t["name"], 0) + weight * (t.get("score") or 0) / best
+        else:
+            for rank, t in enumerate(results, start=1):
+                fused[t["name"]] = fused.get(t["name"], 0) + 1 / (HYBRID_RRF_K + rank)
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [{"name": name, "score": score} for name, score in ranked]
+
+async def search_tags_hybrid(query: str, user_id: str, limit: int = 10, lexical=None, timer: StageTimer | None = None) -> List[dict]:
+    """
+    Lexical and semantic tag retrieval run concurrently, then fused.
+
+    `lexical` may be an already running lexical search (so it overlaps with whatever the
+    caller did before); `timer` records the per-stage latencies. If one side fails, the
+    other side's results are used alone.
+    """
+    timer = timer or StageTimer()
+    if lexical is None:
+        lexical = timer.measure("lexical", search_tags_standard(query, user_id, limit))
+    lexical_tags, semantic_tags = await asyncio.gather(
+        lexical,
+        timer.measure("semantic", search_tags_vector(query, user_id, limit)),
+        return_exceptions=True
+    )
+    if isinstance(semantic_tags, BaseException):
+        print(f"Semantic side of hybrid search failed: {semantic_tags}")
+        semantic_tags = []
+    if isinstance(lexical_tags, BaseException):
+        print(f"Lexical side of hybrid search failed: {lexical_tags}")
+        lexical_tags = []
+    with timer.stage("fusion"):
+        return fuse_tag_rankings(lexical_tags, semantic_tags, limit)
+
+
+# ==================== POST RETRIEVAL ====================
+
+SEARCH_RESULT_PROJECTION = {"file_details": 1, "caption": 1, "tag_names": 1, "created_at": 1}
+# Tag search scores matching posts in windows of this many (newest first), so no query scores a user's whole library at once
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "1000"))
+
+def tag_match(user_id: str, tags: List[dict], window_start=None) -> dict:
+    match = {"user_id": user_id, "tag_names": {"$in": [t["name"] for t in tags]}}
+    if window_start is not None:
+        match["_id"] = {"$lt": window_start}
+    return match
+
+def tag_score_pipeline(user_id: str, tags: List[dict], window_start=None, after: list | None = None, max_candidates: int | None = SEARCH_MAX_CANDIDATES) -> list[dict]:
+    """
+    Aggregation scoring one window of the user's posts carrying any of the matched tags, best first.
+
+    A post's score is the sum of the scores of the matched tags it carries (so a post
+    matching several query concepts outranks one matching a single concept). The window
+    is the newest `max_candidates` matching posts older than `window_start` (None: the
+    newest; max_candidates None: all of them), sorted on (score, _id); `after` is the
+    (score, _id) of the last post already returned from it.
+    """
+    names = [t["name"] for t in tags]
+    scores = [float(t.get("score") or 1.0) for t in tags]
+    pipeline = [{"$match": tag_match(user_id, tags, window_start)}]
+    if max_candidates:
+        pipeline += [{"$sort": {"_id": -1}}, {"$limit": max_candidates}]
+    pipeline += [
+        {
+            "$project": {
+                **SEARCH_RESULT_PROJECTION,
+                "score": {
+                    "$sum": {
+                        "$map": {
+                            "input": "$tag_names",
+                            "as": "tag",
+                            "in": {
+                                "$let": {
+                                    "vars": {"i": {"$indexOfArray": [{"$literal": names}, "$$tag"]}},
+                                    "in": {"$cond": [{"$gte": ["$$i", 0]}, {"$arrayElemAt": [{"$literal": scores}, "$$i"]}, 0]}
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        },
+    ]
+    if after:
+        pipeline.append({"$match": keyset_filter(["score", "_id"], after)})
+    pipeline.append({"$sort": {"score": -1, "_id": -1}})
+    return pipeline
+
+async def next_window(user_id: str, tags: List[dict], window_start=None, max_candidates: int | None = SEARCH_MAX_CANDIDATES):
+    """Start of the scoring window after the one at `window_start`, or None if that one was the last."""
+    if not max_candidates:
+        return None
+    oldest = await posts_collection.find(
+        tag_match(user_id, tags, window_start), {"_id": 1}
+    ).sort("_id", -1).skip(max_candidates - 1).limit(1).to_list(length=1)
+    return oldest[0]["_id"] if oldest else None
+
+def decode_search_cursor(cursor: str | None) -> tuple:
+    """(window_start, after) from a tag search cursor."""
+    if not cursor:
+        return None, None
+    values = decode_cursor(cursor)
+    if len(values) != 3:
+        raise InvalidCursor("Invalid cursor")
+    return values[0], values[1:]
+
+async def iter_posts_by_tags(user_id: str, tags: List[dict], cursor: str | None = None, limit: int | None = None):
+    """
+    Yield (window_start, post) for the matching posts after `cursor`, window by window: each
+    window of SEARCH_MAX_CANDIDATES posts best first, newer windows first. Stops after `limit` posts.
+    """
+    window_start, after = decode_search_cursor(cursor)
+    returned = 0
+    while True:
+        pipeline = tag_score_pipeline(user_id, tags, window_start, after)
+        if limit:
+            pipeline.append({"$limit": limit - returned})
+        async for post in await posts_collection.aggregate(pipeline, allowDiskUse=True, batchSize=STREAM_BATCH_SIZE):
+            yield window_start, post
+            returned += 1
+        if limit and returned >= limit:
+            return
+        window_start, after = await next_window(user_id, tags, window_start), None
+        if window_start is None:
+            return
+
+async def search_posts_by_tags(user_id: str, tags: List[dict], page_size: int, cursor: str | None = None) -> tuple[List[dict], str | None]:
+    """
+    One page of the user's posts carrying any of the matched tags (see iter_posts_by_tags).
+    Returns (posts, next_cursor), next_cursor being None on the last page.
+    """
+    rows = [row async for row in iter_posts_by_tags(user_id, tags, cursor, page_size + 1)]
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        window_start, last = rows[-1]
+        next_cursor = encode_cursor([window_start, last["score"], last["_id"]])
+    posts = [post for _, post in rows]
+    for post in posts:
+        post.pop("_id", None)
+    return posts, next_cursor
+
+def stream_posts_by_tags(user_id: str, tags: List[dict], cursor: str | None = None):
+    """Every remaining result of search_posts_by_tags, in the same order, as an async iterator."""
+    # Decoded eagerly so a bad cursor fails before the response starts
+    decode_search_cursor(cursor)
+
+    async def posts():
+        async for _, post in iter_posts_by_tags(user_id, tags, cursor):
+            post.pop("_id", None)
+            yield post
+    return posts()
+
+async def boolean_tag_filter(user_id: str, query) -> dict:
+    """tag_names filter for a parsed boolean query, matching tags case-insensitively like post_tag_index."""
+    terms = query_tags(query)
+    names_by_lower: dict[str, set[str]] = {}
+    async for tag in tags_collection.find({"user_id": user_id}, {"name": 1, "_id": 0}):
+        lower = tag["name"].lower()
+        if lower in terms:
+            names_by_lower.setdefault(lower, set()).add(tag["name"])
+    return to_mongo_filter(expand_case(query, names_by_lower))
+
+async def search_posts_boolean(user_id: str, query, page_size: int, cursor: str | None = None) -> tuple[List[dict], str | None]:
+    """
+    One page of the user's posts matching a parsed boolean tag query, newest first.
+
+    Evaluated on the in-memory inverted index (post_tag_index), which reloads when the
+    user's stats.version shows a write from another worker; if that fails the query is
+    compiled to a tag_names filter and run in MongoDB instead. Returns (posts, next_cursor).
+    """
+    before = decode_cursor(cursor)[0] if cursor else None
+    try:
+        post_ids, has_more = await post_tag_index.page(user_id, query, page_size, before)
+        docs = await posts_collection.find({"_id": {"$in": post_ids}}, SEARCH_RESULT_PROJECTION).to_list(length=len(post_ids))
+        by_id = {doc["_id"]: doc for doc in docs}
+        posts = [by_id[post_id] for post_id in post_ids if post_id in by_id]
+    except PyMongoError:
+        raise
+    except Exception as e:
+        print(f"Post tag index unavailable ({e}), running boolean query in MongoDB")
+        clauses = [{"user_id": user_id}, await boolean_tag_filter(user_id, query)]
+        if before is not None:
+            clauses.append(keyset_filter(["_id"], [before]))
+        posts = await posts_collection.find({"$and": clauses}, SEARCH_RESULT_PROJECTION).sort("_id", -1).limit(page_size + 1).to_list(length=page_size + 1)
+        has_more = len(posts) > page_size
+        posts = posts[:page_size]
+
+    next_cursor = encode_cursor([posts[-1]["_id"]]) if has_more and posts else None
+    for post in posts:
+        post.pop("_id", None)
+    return posts, next_cursor
+
+async def stream_posts_boolean(user_id: str, query, cursor: str | None = None):
+    """Every remaining result of search_posts_boolean, newest first, streamed from MongoDB."""
+    clauses = [{"user_id": user_id}, await boolean_tag_filter(user_id, query)]
+    if cursor:
+        clauses.append(keyset_filter(["_id"], [decode_cursor(cursor)[0]]))
+
+    async def posts():
+        async for post in posts_collection.find({"$and": clauses}, SEARCH_RESULT_PROJECTION).sort("_id", -1).batch_size(STREAM_BATCH_SIZE):
+            post.pop("_id", None)
+            yield post
+    return posts()
@@ -0,0 +1,174 @@
+from app.actions.http_client import get_session
+from app.actions.resilience import backoff_delay
+from dotenv import load_dotenv
+import aiohttp, asyncio, os, time
+
+load_dotenv()
+
+# Telegram flood limits: ~30 messages/second overall, 1/second per chat and 20/minute per group
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", str(20 / 60)))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+TELEGRAM_MAX_RETRY_AFTER = 60
+TELEGRAM_MAX_CHAT_BUCKETS = 10_000
+
+# Methods that send something to a chat and therefore count against flood limits
+SEND_METHODS = {
+    "sendMessage", "forwardMessage", "copyMessage", "sendPhoto", "sendDocument",
+    "sendVideo", "sendMediaGroup", "sendInvoice", "editMessageText",
+}
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursting up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def idle(self) -> bool:
+        """True when the bucket is full again, i.e. it can be dropped without losing state."""
+        self._refill()
+        return self.tokens >= self.capacity and not self._lock.locked()
+
+    async def acquire(self) -> float:
+        """Take one token, waiting until one is available. Returns the time spent waiting."""
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+
+class TelegramClient:
+    """Bot API client sharing the pooled HTTP session.
+
+    Send methods are scheduled through a global token bucket plus one bucket
+    per chat (groups get the slower group rate). A 429 pauses every call for
+    Telegram's `retry_after`; 5xx and network errors are retried with
+    jittered backoff, except for send methods: Telegram may already have
+    delivered those, so they are only retried after a 429 or when the
+    connection could not be opened at all. Per-endpoint latency and error
+    counters are kept for /metrics.
+    """
+
+    def __init__(self, token: str, max_retries: int = TELEGRAM_MAX_RETRIES):
+        self.token = token
+        self.base_url = f"https://api.telegram.org/bot{token}/"
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE)
+        self._chat_buckets: dict[str, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._metrics: dict[str, dict] = {}
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            if len(self._chat_buckets) >= TELEGRAM_MAX_CHAT_BUCKETS:
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.idle()}
+            # Group and channel ids are negative
+            rate = TELEGRAM_GROUP_RATE if key.startswith("-") else TELEGRAM_CHAT_RATE
+            bucket = self._chat_buckets[key] = TokenBucket(rate, capacity=1)
+        return bucket
+
+    def _endpoint_metrics(self, name: str) -> dict:
+        if name not in self._metrics:
+            self._metrics[name] = {
+                "calls": 0, "errors": 0, "rate_limited": 0, "retries": 0,
+                "total_ms": 0.0, "max_ms": 0.0, "throttled_ms": 0.0,
+            }
+        return self._metrics[name]
+
+    async def _schedule(self, name: str, params: dict | None, stats: dict):
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            stats["throttled_ms"] += pause * 1000
+            await asyncio.sleep(pause)
+        if name in SEND_METHODS:
+            waited = 0.0
+            chat_id = (params or {}).get("chat_id")
+            if chat_id is not None:
+                waited += await self._chat_bucket(chat_id).acquire()
+            waited += await self._global_bucket.acquire()
+            stats["throttled_ms"] += waited * 1000
+
+    async def call(self, endpoint: str, params: dict | None = None, method: str = "get") -> dict:
+        """Call a Bot API method and return {"ok", "status", **telegram_response}."""
+        name = endpoint.split("?", 1)[0]
+        stats = self._endpoint_metrics(name)
+        url = self.base_url + endpoint
+        idempotent = name not in SEND_METHODS
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                stats["retries"] += 1
+            await self._schedule(name, params, stats)
+
+            started = time.perf_counter()
+            try:
+                if method.lower() == "post":
+                    request = get_session().post(url, json=params)
+                else:
+                    request = get_session().get(url, params=params)
+                async with request as response:
+                    status = response.status
+                    data = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                stats["errors"] += 1
+                # A failed connect means nothing was sent; anything later may have been delivered
+                if attempt >= self.max_retries or not (idempotent or isinstance(e, aiohttp.ClientConnectorError)):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            finally:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                stats["calls"] += 1
+                stats["total_ms"] += elapsed_ms
+                stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+            if status == 429:
+                stats["rate_limited"] += 1
+                retry_after = (data.get("parameters") or {}).get("retry_after") or backoff_delay(attempt)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                if attempt < self.max_retries and retry_after <= TELEGRAM_MAX_RETRY_AFTER:
+                    continue
+            elif status >= 500:
+                stats["errors"] += 1
+                if attempt < self.max_retries and idempotent:
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+            elif status != 200:
+                stats["errors"] += 1
+
+            return {"ok": status == 200, "status": status, **data}
+
+    def metrics(self) -> dict:
+        endpoints = {}
+        for name, stats in self._metrics.items():
+            endpoints[name] = {
+                **{k: round(v, 2) if isinstance(v, float) else v for k, v in stats.items()},
+                "avg_ms": round(stats["total_ms"] / stats["calls"], 2) if stats["calls"] else 0.0,
+            }
+        return {
+            "endpoints": endpoints,
+            "chat_buckets": len(self._chat_buckets),
+            "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 2),
+        }
+
+
+telegram_client = TelegramClient(os.getenv("BOT_API"))
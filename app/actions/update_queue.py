@@ -0,0 +1,276 @@
+from app.dependency import updates_collection
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import asyncio, os, time, zlib
+
+load_dotenv()
+
+UPDATE_QUEUE_BACKEND = os.getenv("UPDATE_QUEUE_BACKEND", "mongo")  # "mongo" or "memory"
+UPDATE_QUEUE_WORKERS = int(os.getenv("UPDATE_QUEUE_WORKERS", "4"))
+UPDATE_QUEUE_MAX_PENDING = int(os.getenv("UPDATE_QUEUE_MAX_PENDING", "200"))
+UPDATE_QUEUE_LEASE_SECONDS = int(os.getenv("UPDATE_QUEUE_LEASE_SECONDS", "600"))
+UPDATE_QUEUE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_QUEUE_DRAIN_TIMEOUT", "20"))
+# Serverless runtimes (Vercel sets VERCEL=1) freeze the process after the response, so
+# background workers cannot be relied on there; updates are then handled within the request
+UPDATE_QUEUE_INLINE = os.getenv("UPDATE_QUEUE_INLINE", "1" if os.getenv("VERCEL") else "0") == "1"
+
+
+class UpdateQueueFull(Exception):
+    """Raised when too many updates are pending; the webhook answers 503 so Telegram redelivers later."""
+
+
+def update_partition_key(update: dict) -> str:
+    """Key that keeps one user's updates in order (same worker, FIFO)."""
+    for field in ("message", "edited_message", "callback_query", "pre_checkout_query"):
+        sender = (update.get(field) or {}).get("from") or {}
+        if sender.get("id") is not None:
+            return str(sender["id"])
+    return str(update.get("update_id"))
+
+
+class MongoUpdateStore:
+    """Outbox of webhook updates in `updates`, keyed (and so deduplicated) by update_id.
+
+    Updates are leased to the process that accepted them; a pending update
+    whose lease ran out (crash, restart, serverless freeze) is reclaimed by
+    the next process that starts.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def add(self, update: dict, partition_key: str) -> bool:
+        now = datetime.now()
+        try:
+            await self.collection.insert_one({
+                "_id": update["update_id"],
+                "update": update,
+                "partition_key": partition_key,
+                "status": "pending",
+                "enqueued_at": now,
+                "lease_until": now + timedelta(seconds=UPDATE_QUEUE_LEASE_SECONDS),
+            })
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def done(self, update_id, error: str | None = None):
+        await self.collection.update_one(
+            {"_id": update_id},
+            {"$set": {"status": "failed" if error else "done", "error": error, "done_at": datetime.now()}}
+        )
+
+    async def reclaim(self, limit: int) -> list[dict]:
+        """Claim pending updates with an expired lease, oldest first."""
+        claimed = []
+        while len(claimed) < limit:
+            now = datetime.now()
+            doc = await self.collection.find_one_and_update(
+                {"status": "pending", "lease_until": {"$lt": now}},
+                {"$set": {"lease_until": now + timedelta(seconds=UPDATE_QUEUE_LEASE_SECONDS)}},
+                sort=[("enqueued_at", 1)]
+            )
+            if doc is None:
+                break
+            claimed.append(doc)
+        return claimed
+
+
+class MemoryUpdateStore:
+    """Local stand-in for MongoUpdateStore: deduplicates, but does not survive a restart."""
+
+    def __init__(self, max_seen: int = 10_000):
+        self._seen: dict = {}
+        self.max_seen = max_seen
+
+    async def add(self, update: dict, partition_key: str) -> bool:
+        update_id = update["update_id"]
+        if update_id in self._seen:
+            return False
+        self._seen[update_id] = True
+        if len(self._seen) > self.max_seen:
+            self._seen.pop(next(iter(self._seen)))
+        return True
+
+    async def done(self, update_id, error: str | None = None):
+        pass
+
+    async def reclaim(self, limit: int) -> list[dict]:
+        return []
+
+
+class UpdateQueue:
+    """Bounded worker pool in front of the webhook update handler.
+
+    Updates are persisted to the store before the webhook acknowledges them.
+    Each user's updates are routed to the same worker so they are handled in
+    order; at most `workers` updates run at once and at most `max_pending`
+    may wait, beyond which enqueue raises UpdateQueueFull.
+
+    The workers start with the app's lifespan, or on the first enqueue when no
+    lifespan ran. With UPDATE_QUEUE_INLINE no workers are started at all and
+    each update is handled before enqueue returns, under the same limits: at
+    most `workers` at once, and one at a time per user.
+    """
+
+    def __init__(self, store, workers: int = UPDATE_QUEUE_WORKERS, max_pending: int = UPDATE_QUEUE_MAX_PENDING, inline: bool = UPDATE_QUEUE_INLINE):
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self.inline = inline
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+        self._handler = None
+        self._pending: dict = {}  # update_id -> enqueued_at, for depth and lag
+        self._stopped = False
+        self._starting: asyncio.Lock | None = None
+        self._slots: asyncio.Semaphore | None = None  # inline mode's stand-in for the workers
+        self._partition_locks: dict[str, tuple[asyncio.Lock, int]] = {}  # key -> (lock, updates holding or waiting)
+        self.counters = {
+            "enqueued": 0, "duplicates": 0, "rejected": 0,
+            "processed": 0, "failed": 0, "reclaimed": 0, "total_ms": 0.0,
+        }
+
+    def set_handler(self, handler):
+        self._handler = handler
+
+    async def start(self, handler=None):
+        """Start the workers and pick up updates left over by a previous process."""
+        if handler is not None:
+            self._handler = handler
+        self._stopped = False
+        if self._tasks or self.inline:
+            return
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+        self._tasks.append(asyncio.create_task(self._reclaimer()))
+        await self._reclaim()
+
+    async def _ensure_started(self):
+        if self._starting is None:
+            self._starting = asyncio.Lock()
+        async with self._starting:
+            await self.start()
+
+    async def _reclaim(self):
+        room = self.max_pending - len(self._pending)
+        if room <= 0:
+            return
+        try:
+            leftovers = await self.store.reclaim(limit=room)
+        except Exception as e:
+            print(f"Failed to reclaim pending updates: {e}")
+            return
+        for doc in leftovers:
+            if doc["_id"] in self._pending:
+                continue
+            self.counters["reclaimed"] += 1
+            self._dispatch(doc["update"], doc["partition_key"], doc["enqueued_at"].timestamp())
+
+    async def _reclaimer(self):
+        """Periodically pick up updates whose owner died before finishing them."""
+        while True:
+            await asyncio.sleep(UPDATE_QUEUE_LEASE_SECONDS / 2)
+            await self._reclaim()
+
+    async def enqueue(self, update: dict) -> bool:
+        """Persist and schedule an update. Returns False for an already seen update_id."""
+        if self._stopped or len(self._pending) >= self.max_pending:
+            self.counters["rejected"] += 1
+            raise UpdateQueueFull("Update queue is full")
+        if not self._tasks and not self.inline:
+            await self._ensure_started()
+        partition_key = update_partition_key(update)
+        if not await self.store.add(update, partition_key):
+            self.counters["duplicates"] += 1
+            return False
+        self.counters["enqueued"] += 1
+        if self.inline:
+            self._pending[update["update_id"]] = time.time()
+            await self._run_inline(update, partition_key)
+        else:
+            self._dispatch(update, partition_key, time.time())
+        return True
+
+    def _dispatch(self, update: dict, partition_key: str, enqueued_at: float):
+        self._pending[update.get("update_id")] = enqueued_at
+        queue = self._queues[zlib.crc32(partition_key.encode()) % len(self._queues)]
+        queue.put_nowait(update)
+
+    async def _run(self, update: dict):
+        """Handle one update and record the outcome in the store."""
+        update_id = update.get("update_id")
+        started = time.perf_counter()
+        error = None
+        try:
+            await self._handler(update)
+        except Exception as e:
+            error = str(e)
+            print(f"Update {update_id} failed: {e}")
+        self.counters["failed" if error else "processed"] += 1
+        self.counters["total_ms"] += (time.perf_counter() - started) * 1000
+        try:
+            await self.store.done(update_id, error)
+        except Exception as e:
+            print(f"Failed to mark update {update_id} done: {e}")
+        finally:
+            self._pending.pop(update_id, None)
+
+    async def _run_inline(self, update: dict, partition_key: str):
+        """_run in the request, after earlier updates of the same user and within the workers cap."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        lock, holders = self._partition_locks.get(partition_key, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._partition_locks[partition_key] = (lock, holders + 1)
+        try:
+            async with lock, self._slots:
+                await self._run(update)
+        finally:
+            lock, holders = self._partition_locks[partition_key]
+            if holders > 1:
+                self._partition_locks[partition_key] = (lock, holders - 1)
+            else:
+                del self._partition_locks[partition_key]
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self._run(update)
+            finally:
+                queue.task_done()
+
+    async def stop(self, timeout: float = UPDATE_QUEUE_DRAIN_TIMEOUT):
+        """Stop accepting updates and let the workers drain, up to `timeout` seconds.
+
+        Anything still queued afterwards stays pending in the store and is
+        reclaimed on the next start.
+        """
+        self._stopped = True
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            print(f"Update queue drain timed out with {len(self._pending)} updates pending")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        oldest = min(self._pending.values(), default=None)
+        finished = self.counters["processed"] + self.counters["failed"]
+        return {
+            **{k: v for k, v in self.counters.items() if k != "total_ms"},
+            "depth": len(self._pending),
+            "lag_s": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+            "avg_ms": round(self.counters["total_ms"] / finished, 2) if finished else 0.0,
+            "workers": self.workers if self.inline else len(self._queues),
+            "inline": self.inline,
+        }
+
+
+update_queue = UpdateQueue(MemoryUpdateStore() if UPDATE_QUEUE_BACKEND == "memory" else MongoUpdateStore(updates_collection))
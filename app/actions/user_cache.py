@@ -0,0 +1,165 @@
+from app.dependency import users_collection
+from app.actions.singleflight import SingleFlight
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from dotenv import load_dotenv
+import asyncio, os, time
+
+load_dotenv()
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_SYNC = os.getenv("USER_CACHE_SYNC", "change_stream")  # "change_stream" or "local"
+
+# Only these user fields are cached; a change stream event touching any of them invalidates the entry
+CACHED_FIELDS = ("chat_id", "membership")
+
+_MISSING = object()
+
+
+@dataclass
+class UserProfile:
+    """Compact view of a user document for hot-path checks."""
+    user_id: str
+    chat_id: str | None
+    membership: dict = field(default_factory=dict)
+    post_count: int = 0
+
+    @property
+    def plan(self) -> str | None:
+        return self.membership.get("plan")
+
+    @property
+    def expires_at(self) -> datetime | None:
+        expires_at = self.membership.get("expires_at")
+        if isinstance(expires_at, str):
+            expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
+        return expires_at
+
+    @property
+    def is_premium(self) -> bool:
+        return bool(self.expires_at and datetime.now() < self.expires_at)
+
+
+class UserCache:
+    """Read-through cache of UserProfile records keyed by user_id.
+
+    Entries live for USER_CACHE_TTL at most and are dropped as soon as the
+    user changes: locally through `invalidate`, and for other workers through
+    a change stream on `users` (USER_CACHE_SYNC=change_stream). With
+    USER_CACHE_SYNC=local only this process's own invalidations apply, which
+    is enough for a single worker.
+    """
+
+    def __init__(self, max_entries: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple] = OrderedDict()  # user_id -> (profile | _MISSING, _id, expires)
+        self._by_oid: dict = {}
+        self._flight = SingleFlight()
+        self._watcher: asyncio.Task | None = None
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0, "remote_invalidations": 0}
+
+    async def _load(self, user_id: str):
+        return await users_collection.find_one(
+            {"user_id": user_id},
+            # Users not yet reconciled have no stats counters, only the legacy posts array
+            {"chat_id": 1, "membership": 1, "post_count": {"$ifNull": ["$stats.posts", {"$size": {"$ifNull": ["$posts", []]}}]}}
+        )
+
+    async def get(self, user_id) -> UserProfile | None:
+        """The user's profile, or None if there is no such user."""
+        user_id = str(user_id)
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[2] > time.monotonic():
+            self.counters["hits"] += 1
+            self._entries.move_to_end(user_id)
+            return None if entry[0] is _MISSING else entry[0]
+
+        self.counters["misses"] += 1
+        doc = await self._flight.do(user_id, lambda: self._load(user_id))
+        if doc is None:
+            self._remember(user_id, _MISSING, None)
+            return None
+        profile = UserProfile(
+            user_id=user_id,
+            chat_id=doc.get("chat_id"),
+            membership=doc.get("membership") or {},
+            post_count=doc.get("post_count", 0),
+        )
+        self._remember(user_id, profile, doc["_id"])
+        return profile
+
+    def _remember(self, user_id: str, profile, oid):
+        self._entries[user_id] = (profile, oid, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user_id)
+        if oid is not None:
+            self._by_oid[oid] = user_id
+        while len(self._entries) > self.max_entries:
+            _, (_, old_oid, _) = self._entries.popitem(last=False)
+            self._by_oid.pop(old_oid, None)
+
+    def invalidate(self, user_id):
+        entry = self._entries.pop(str(user_id), None)
+        if entry is not None:
+            self.counters["invalidations"] += 1
+            self._by_oid.pop(entry[1], None)
+
+    def set_post_count(self, user_id, count: int):
+        """Keep the cached post count current (from the counter update) without a re-read."""
+        entry = self._entries.get(str(user_id))
+        if entry is not None and entry[0] is not _MISSING:
+            entry[0].post_count = count
+
+    async def _watch(self):
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        while True:
+            try:
+                async with await users_collection.watch(pipeline) as stream:
+                    async for change in stream:
+                        self._apply_change(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"User cache change stream failed ({e}), retrying; entries still expire after {self.ttl}s")
+                await asyncio.sleep(30)
+
+    def _apply_change(self, change: dict):
+        if change["operationType"] == "insert":
+            user_id = change.get("fullDocument", {}).get("user_id")
+        else:
+            if change["operationType"] == "update":
+                updated = change.get("updateDescription", {}).get("updatedFields", {})
+                if not any(key.split(".", 1)[0] in CACHED_FIELDS for key in updated):
+                    return
+            user_id = self._by_oid.get(change.get("documentKey", {}).get("_id"))
+        if user_id is not None and user_id in self._entries:
+            self.counters["remote_invalidations"] += 1
+            self.invalidate(user_id)
+
+    def start(self):
+        if USER_CACHE_SYNC == "change_stream" and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "sync": USER_CACHE_SYNC,
+            "watching": self._watcher is not None and not self._watcher.done(),
+        }
+
+
+user_cache = UserCache()
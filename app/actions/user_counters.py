@@ -0,0 +1,182 @@
+from app.dependency import users_collection, posts_collection, tags_collection, leases_collection
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import asyncio, os, socket, time, uuid
+
+load_dotenv()
+
+COUNTER_RECONCILE_INTERVAL = float(os.getenv("COUNTER_RECONCILE_INTERVAL", "21600"))
+COUNTER_FIELDS = ("posts", "tagged_posts", "tags")
+
+
+async def count_stats(user_id: str, session=None) -> dict:
+    """The user's counters computed from posts and tags."""
+    return {
+        "posts": await posts_collection.count_documents({"user_id": user_id}, session=session),
+        "tagged_posts": await posts_collection.count_documents({"user_id": user_id, "tag_names.0": {"$exists": True}}, session=session),
+        "tags": await tags_collection.count_documents({"user_id": user_id}, session=session),
+    }
+
+
+async def increment(user_id: str, session=None, **deltas: int) -> dict | None:
+    """
+    Atomically add `deltas` to the user's stats counters; returns the counters after the update.
+
+    Call it after every post or tag write, even one that leaves the counters unchanged: it
+    also bumps `stats.version`, which tells the in-memory indexes of other processes that
+    the user's data changed. Users created before counters existed have no `stats` yet: the
+    first increment seeds them from a count of posts and tags instead, which already
+    includes that write.
+    """
+    user_id = str(user_id)
+    inc = {f"stats.{name}": delta for name, delta in deltas.items() if delta}
+    inc["stats.version"] = 1
+    for _ in range(2):
+        doc = await users_collection.find_one_and_update(
+            {"user_id": user_id, "stats": {"$exists": True}},
+            {"$inc": inc},
+            projection={"stats": 1, "_id": 0},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if doc is not None:
+            return doc["stats"]
+        seeded = {**await count_stats(user_id, session=session), "version": 1}
+        doc = await users_collection.find_one_and_update(
+            {"user_id": user_id, "stats": {"$exists": False}},
+            {"$set": {"stats": seeded}},
+            projection={"_id": 1},
+            session=session
+        )
+        if doc is not None:
+            return seeded
+        # Another write seeded the counters first (or the user does not exist): increment those
+    return None
+
+
+class CounterReconciler:
+    """Periodically recomputes every user's stats counters from posts and tags.
+
+    The counters are maintained incrementally on every write; this job repairs
+    any drift (failed writes, manual edits). It is a full scan, so it only
+    runs in the process holding the `leases` entry for the interval: the
+    first process to start runs it right away, the rest skip until the lease
+    expires. Serverless deployments should run it from cron instead:
+    `python -m app.actions.user_counters`.
+    """
+
+    LEASE_ID = "counter_reconciler"
+
+    def __init__(self, interval: float = COUNTER_RECONCILE_INTERVAL):
+        self.interval = interval
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task: asyncio.Task | None = None
+        self.counters = {"runs": 0, "users_updated": 0, "last_run_ms": 0.0, "errors": 0, "skipped_not_leader": 0}
+
+    async def acquire_lease(self) -> bool:
+        """Take (or renew) the reconcile lease for one interval; False if another process holds it."""
+        now = datetime.now()
+        try:
+            await leases_collection.find_one_and_update(
+                {"_id": self.LEASE_ID, "$or": [{"expires_at": {"$lt": now}}, {"holder": self.holder}]},
+                {"$set": {"holder": self.holder, "expires_at": now + timedelta(seconds=self.interval)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # The lease exists and is held by someone else, so the upsert's insert collided
+            return False
+
+    async def reconcile(self) -> int:
+        """
+        Recompute every user's counters and correct the ones that drifted.
+
+        Users are read before the counts, and each correction is guarded by the counters
+        seen then: an increment landing in between changes them, so that user is left alone
+        rather than overwritten with a count that may miss the write. Users with no posts or
+        tags left are reset to 0.
+        """
+        started = time.perf_counter()
+        seen = {
+            user["user_id"]: user.get("stats")
+            async for user in users_collection.find({}, {"user_id": 1, "stats": 1, "_id": 0})
+        }
+        stats: dict[str, dict] = {}
+        post_rows = await (await posts_collection.aggregate([
+            {"$group": {
+                "_id": "$user_id",
+                "posts": {"$sum": 1},
+                "tagged_posts": {"$sum": {"$cond": [{"$gt": [{"$size": {"$ifNull": ["$tag_names", []]}}, 0]}, 1, 0]}},
+            }}
+        ])).to_list(length=None)
+        for row in post_rows:
+            stats.setdefault(row["_id"], {})
+            stats[row["_id"]].update(posts=row["posts"], tagged_posts=row["tagged_posts"])
+        tag_rows = await (await tags_collection.aggregate([
+            {"$group": {"_id": "$user_id", "tags": {"$sum": 1}}}
+        ])).to_list(length=None)
+        for row in tag_rows:
+            stats.setdefault(row["_id"], {})["tags"] = row["tags"]
+
+        operations = []
+        for user_id, current in seen.items():
+            values = {name: stats.get(user_id, {}).get(name, 0) for name in COUNTER_FIELDS}
+            if current is None:
+                guard = {"stats": {"$exists": False}}
+            elif all(current.get(name) == values[name] for name in COUNTER_FIELDS):
+                continue
+            else:
+                guard = {f"stats.{name}": current.get(name) for name in COUNTER_FIELDS}
+            operations.append(UpdateOne(
+                {"user_id": user_id, **guard},
+                {"$set": {f"stats.{name}": value for name, value in values.items()}}
+            ))
+        updated = 0
+        if operations:
+            result = await users_collection.bulk_write(operations, ordered=False)
+            updated = result.modified_count
+        self.counters["runs"] += 1
+        self.counters["users_updated"] += updated
+        self.counters["last_run_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return updated
+
+    async def _loop(self):
+        while True:
+            try:
+                if await self.acquire_lease():
+                    updated = await self.reconcile()
+                    if updated:
+                        print(f"Counter reconciliation corrected {updated} users")
+                else:
+                    self.counters["skipped_not_leader"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counters["errors"] += 1
+                print(f"Counter reconciliation failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+counter_reconciler = CounterReconciler()
+
+
+if __name__ == "__main__":
+    print(f"Corrected {asyncio.run(counter_reconciler.reconcile())} users")
@@ -0,0 +1,184 @@
+from app.dependency import tags_collection
+from app.actions.lazy_index import LazyUserIndexes
+from dotenv import load_dotenv
+import numpy as np
+import asyncio, os
+
+load_dotenv()
+
+VECTOR_INDEX_USERS = int(os.getenv("VECTOR_INDEX_USERS", "200"))
+# Above this many tags a user also gets an approximate (IVF) index
+VECTOR_ANN_THRESHOLD = int(os.getenv("VECTOR_ANN_THRESHOLD", "20000"))
+VECTOR_ANN_PROBES = int(os.getenv("VECTOR_ANN_PROBES", "8"))
+# Rebuild the IVF index once the rows added since the last build exceed this fraction of it
+VECTOR_ANN_REBUILD_GROWTH = float(os.getenv("VECTOR_ANN_REBUILD_GROWTH", "0.1"))
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class IVFIndex:
+    """Inverted-file approximate index: k-means centroids, search only the closest `probes` lists."""
+
+    def __init__(self, matrix: np.ndarray, lists: int | None = None, iterations: int = 10, seed: int = 0):
+        n = matrix.shape[0]
+        lists = lists or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        centroids = matrix[rng.choice(n, size=lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(matrix @ centroids.T, axis=1)
+            for c in range(lists):
+                members = matrix[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize_rows(centroids)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        assignment = np.argmax(matrix @ self.centroids.T, axis=1)
+        self.lists = [np.flatnonzero(assignment == c) for c in range(lists)]
+
+    def candidates(self, query: np.ndarray, probes: int) -> np.ndarray:
+        nearest = np.argsort(-(self.centroids @ query))[:probes]
+        return np.concatenate([self.lists[c] for c in nearest])
+
+
+class UserVectorIndex:
+    """One user's tag embeddings as a contiguous, row-normalised float32 matrix.
+
+    Large vocabularies get an IVF index, built off the event loop by
+    `build_ann`. It covers the first `_ann_rows` rows; rows appended since are
+    searched exactly alongside its candidates, and a removal (which shifts
+    rows) drops it until the next build.
+    """
+
+    def __init__(self, names: list[str], matrix: np.ndarray):
+        self.names = list(names)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.ann: IVFIndex | None = None
+        self._ann_rows = 0
+        self._removals = 0
+        self._ann_building = False
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, names: list[str], embeddings):
+        rows = []
+        for name, embedding in zip(names, embeddings):
+            if name in self.positions:
+                continue
+            self.positions[name] = len(self.names)
+            self.names.append(name)
+            rows.append(np.asarray(embedding, dtype=np.float32))
+        if rows:
+            new = normalize_rows(np.stack(rows))
+            self.matrix = np.ascontiguousarray(np.vstack([self.matrix, new]) if self.matrix.size else new)
+
+    def remove(self, name: str):
+        position = self.positions.pop(name, None)
+        if position is None:
+            return
+        self.matrix = np.ascontiguousarray(np.delete(self.matrix, position, axis=0))
+        del self.names[position]
+        self.positions = {n: i for i, n in enumerate(self.names)}
+        self.ann, self._ann_rows = None, 0
+        self._removals += 1
+
+    def needs_ann_build(self) -> bool:
+        if len(self.names) < VECTOR_ANN_THRESHOLD or self._ann_building:
+            return False
+        return self.ann is None or len(self.names) - self._ann_rows > VECTOR_ANN_REBUILD_GROWTH * self._ann_rows
+
+    def build_ann(self) -> asyncio.Task:
+        """Start building the IVF index in a worker thread from a snapshot of the matrix."""
+        self._ann_building = True
+        return asyncio.ensure_future(self._build_ann(self.matrix, self._removals))
+
+    async def _build_ann(self, matrix: np.ndarray, removals: int):
+        try:
+            ann = await asyncio.to_thread(IVFIndex, matrix)
+            if removals == self._removals:  # otherwise rows moved under it; the next search rebuilds
+                self.ann, self._ann_rows = ann, matrix.shape[0]
+        except Exception as e:
+            print(f"IVF index build failed: {e}")
+        finally:
+            self._ann_building = False
+
+    def search(self, query: np.ndarray, k: int) -> list[tuple[str, float]]:
+        """Top-k tags by cosine similarity, via the IVF index when one is built, otherwise exact."""
+        if not self.names:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        if self.ann is not None and len(self.names) >= VECTOR_ANN_THRESHOLD:
+            candidates = np.concatenate([
+                self.ann.candidates(query, VECTOR_ANN_PROBES),
+                np.arange(self._ann_rows, len(self.names)),
+            ])
+            scores = self.matrix[candidates] @ query
+        else:
+            candidates = None
+            scores = self.matrix @ query
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = candidates[top] if candidates is not None else top
+        return [(self.names[r], float(s)) for r, s in zip(rows, scores[top])]
+
+
+class LocalVectorSearch(LazyUserIndexes):
+    """In-process semantic tag search, used instead of (or as a fallback for) Atlas $vectorSearch.
+
+    A user's index is loaded lazily from `tags` on first search, kept in an
+    LRU of VECTOR_INDEX_USERS users, updated in place as tags are saved or
+    removed and reloaded when another worker has written. IVF builds run in the background; searches stay exact until
+    one finishes.
+    """
+
+    def __init__(self, max_users: int = VECTOR_INDEX_USERS):
+        super().__init__(max_users)
+        self._builds: set[asyncio.Task] = set()
+        self.counters.update(searches=0, ann_builds=0)
+
+    async def _load(self, user_id: str) -> UserVectorIndex:
+        docs = await tags_collection.find(
+            {"user_id": user_id, "embedding": {"$ne": None}},
+            {"name": 1, "embedding": 1, "_id": 0}
+        ).to_list(length=None)
+        if not docs:
+            return UserVectorIndex([], np.zeros((0, 0), dtype=np.float32))
+        matrix = normalize_rows(np.asarray([d["embedding"] for d in docs], dtype=np.float32))
+        return UserVectorIndex([d["name"] for d in docs], matrix)
+
+    async def search(self, user_id: str, query_embedding, limit: int = 10) -> list[dict]:
+        """Same shape as the Atlas pipeline: [{"name", "score"}], score = (1 + cosine) / 2."""
+        self.counters["searches"] += 1
+        index = await self.get(user_id)
+        if index.needs_ann_build():
+            self.counters["ann_builds"] += 1
+            task = index.build_ann()
+            self._builds.add(task)
+            task.add_done_callback(self._builds.discard)
+        return [{"name": name, "score": (1 + cos) / 2} for name, cos in index.search(query_embedding, limit)]
+
+    def tags_added(self, user_id: str, names: list[str], embeddings, version: int | None = None):
+        self._apply(user_id, lambda index: index.add(names, embeddings), version)
+
+    def tag_removed(self, user_id: str, name: str, version: int | None = None):
+        self._apply(user_id, lambda index: index.remove(name), version)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "users_loaded": len(self._users),
+            "vectors": sum(len(i) for i in self._users.values()),
+            "ann_building": len(self._builds),
+        }
+
+
+local_vector_search = LocalVectorSearch()
@@ -23,6 +23,11 @@ try:
     tags_collection = db.tags
     boards_collection = db.boards
     invoices_collection = db.invoices
+    updates_collection = db.updates
+    tag_results_collection = db.tag_results
+    embedding_cache_collection = db.embedding_cache
+    file_paths_collection = db.file_paths
+    leases_collection = db.leases
     print("MongoDB connection successful")
 except Exception as e:
     print(f"Error connecting to MongoDB: {e}")
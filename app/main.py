@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from fastapi import Depends, FastAPI, Query, Response, APIRouter,HTTPException, Body, Header, Request
 from dotenv import load_dotenv
@@ -5,12 +6,39 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 import requests, os, base64, logging, asyncio
 from app.actions.middleware import UserValidationMiddleware
-from app.actions.security import validate_init_data
+from app.actions.security import validate_init_data, init_data_cache
 from app.actions.telegram import TelegramFilePathFetcher
+from app.actions.http_client import close_session, get_session
+from app.actions.telegram_client import telegram_client
+from app.actions.gemini import gemini_metrics
+from app.actions.tag_vocabulary import tag_vocabulary_cache
+from app.actions.embeddings import embedding_engine, embedding_cache
+from app.actions.vector_index import local_vector_search
+from app.actions.tag_index import local_tag_search
+from app.actions.tag_cache import tag_result_cache, content_hash, perceptual_hash
+from app.actions.resilience import CircuitOpen
+from app.actions.update_queue import update_queue, UpdateQueueFull
+from app.actions.file_refresh import file_path_refresher, path_refresh_flight, identity_flight, refresh_file_path_once, fetch_file_identity_once
+from app.actions.image_cache import image_cache, image_cache_key
+from app.actions.boolean_query import QuerySyntaxError, looks_boolean, parse_query
+from app.actions.post_index import post_tag_index
+from app.actions.lazy_index import user_written
+from app.actions.user_cache import user_cache
+from app.actions.indexes import ensure_indexes
+from app.actions.file_paths import file_path_index
+from app.actions.boards import list_user_boards
+from app.actions.post_feed import list_user_posts, list_board_posts, stream_user_posts
+from app.actions.streaming import streaming_response
+from app.actions.user_counters import counter_reconciler, increment
+from app.actions.latency import StageTimer, search_latency
+from app.actions.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursor, page_size
+from app.actions.http_cache import RangeNotSatisfiable, etag_for_key, etag_matches, http_date, image_headers, parse_byte_range, requested_range
 from app.dependency import invoices_collection, users_collection, posts_collection, tags_collection, boards_collection
-from app.actions.telegram_bot import is_premium_user, search_tags_standard, search_tags_semantic, upgrade_plan, run_tele_api, verify_image_path, remove_tag_from_post, serialize_doc, send_msg, handle_new_user, get_file_path, extract_photo_details, save_post, generate_tags, save_tags_and_update_post, fetch_mime_type, get_image, fetch_post_from_file_path
+from app.actions.telegram_bot import is_premium_user, search_tags_standard, search_tags_semantic, search_tags_hybrid, search_posts_by_tags, search_posts_boolean, stream_posts_by_tags, stream_posts_boolean, SEARCH_RANKING, upgrade_plan, run_tele_api, verify_image_path, remove_tag_from_post, serialize_doc, send_msg, handle_new_user, get_file_path, extract_photo_details, save_post, generate_tags, save_tags_and_update_post, fetch_mime_type, get_image, open_image_stream, head_image, cache_image_stream, fetch_post_from_file_path, resolve_post_ids
 from urllib.parse import unquote, parse_qsl
+from pymongo import UpdateOne
 from app.schemas.users import PaymentRecord, PlanType, PreviousPlan, Membership, InvoiceRequest
+from typing import Optional
 import json
 
 
@@ -20,7 +48,23 @@ TELE_FILE_URL = os.getenv("TELE_FILE_URL")
 # FRONTEND_URL = os.getenv("FRONTEND_URL")
 BOT_API = os.getenv("BOT_API")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the pooled HTTP session shared by the Telegram client and image proxy
+    get_session()
+    await ensure_indexes()
+    file_path_refresher.start()
+    user_cache.start()
+    counter_reconciler.start()
+    await update_queue.start(process_update)
+    yield
+    await update_queue.stop()
+    await counter_reconciler.stop()
+    await user_cache.stop()
+    await file_path_refresher.stop()
+    await close_session()
+
+app = FastAPI(lifespan=lifespan)
 router = APIRouter()
 
 # app.include_router(router)
@@ -36,7 +80,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers including Authorization
-    expose_headers=["X-File-Path"] 
+    expose_headers=["X-File-Path", "ETag", "Content-Range", "X-Next-Cursor", "Server-Timing"]
 )
 
 # Add authentication middleware AFTER CORS
@@ -48,106 +92,143 @@ async def hello():
 
 @app.post("/webhook")
 async def telegram_webhook(update: dict = Body(...)):
-    asyncio.create_task(process_update(update))
+    if not isinstance(update.get("update_id"), int):
+        raise HTTPException(status_code=400, detail="Missing or invalid update_id")
+    try:
+        await update_queue.enqueue(update)
+    except UpdateQueueFull:
+        # Telegram redelivers updates that were not acknowledged with 2xx
+        raise HTTPException(status_code=503, detail="Busy, retry later")
     return {"ok": True}
 
 @app.get('/test')
 async def test():
     try:
-        file_path = await get_file_path(file_id="AgACAgUAAxkBAAOKaJjhrc4UQrIuNwPWpYQ_PV751vwAAm3IMRvWLchUa956uPM7MDIBAAMCAAN4AAM2BA",message_id="139", chat_id="1892630283", resolution="medium", user_id="1892630283")
+        file_path = await get_file_path(file_id="AgACAgUAAxkBAAOKaJjhrc4UQrIuNwPWpYQ_PV751vwAAm3IMRvWLchUa956uPM7MDIBAAMCAAN4AAM2BA",message_id="139", chat_id="1892630283", resolution="medium")
         return file_path
     except Exception as e:
         return HTTPException(status_code=500, detail=str(e))
 
+def image_response(image: dict, headers: dict) -> StreamingResponse:
+    """Build a pass-through streaming response from an open_image_stream result."""
+    headers = dict(headers)
+    if image.get("content_length") is not None:
+        headers["Content-Length"] = str(image["content_length"])
+    if image.get("content_range"):
+        headers["Content-Range"] = image["content_range"]
+    return StreamingResponse(image["body"], status_code=image.get("status", 200), media_type=image["media_type"], headers=headers)
+
+def cached_image_response(cached, headers: dict, range_header: str | None, is_head: bool) -> Response:
+    """Serve cached image bytes, honouring a byte range and HEAD."""
+    size = len(cached.content)
+    headers = dict(headers)
+    if cached.last_modified is not None:
+        headers["Last-Modified"] = http_date(cached.last_modified)
+    status_code, body = 200, cached.content
+    if range_header:
+        try:
+            byte_range = parse_byte_range(range_header, size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:  # otherwise the header is malformed and ignored
+            start, end = byte_range
+            status_code, body = 206, cached.content[start:end + 1]
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    if is_head:
+        headers["Content-Length"] = str(len(body))
+        return Response(status_code=status_code, media_type=cached.media_type, headers=headers)
+    return Response(content=body, status_code=status_code, media_type=cached.media_type, headers=headers)
+
+def head_image_response(image: dict, headers: dict) -> Response:
+    """Answer a HEAD request from upstream metadata only."""
+    headers = dict(headers)
+    if image.get("content_length") is not None:
+        headers["Content-Length"] = str(image["content_length"])
+    return Response(media_type=image["media_type"], headers=headers)
+
 @app.api_route("/getImage", methods=["GET", "HEAD"])
-async def getImage(file_path: str = Query(...)):
+async def getImage(request: Request, file_path: str = Query(...)):
     """
     Returns image content for the given file_path.
-    if not found refethes from telegram and updates DB accordingly and send the updated file path in response header 'X-new-file-path'.
+    if not found refethes from telegram and updates DB accordingly and send the updated file path in response header 'X-File-Path'.
+    Supports conditional requests (ETag / If-None-Match), byte ranges and HEAD without downloading the body.
     """
     try:
+        is_head = request.method == "HEAD"
+        post = None
+
+        # Resolve the stable file identity so refreshed paths share cache entries and ETags
+        cache_key = image_cache.key_for_path(file_path)
+        if not cache_key:
+            post = await fetch_file_identity_once(file_path)
+            if post:
+                cache_key = post["cache_key"]
+                image_cache.alias(file_path, cache_key)
+                if post.get("file_path"):
+                    image_cache.alias(post["file_path"], cache_key, current=True)
+
+        etag = etag_for_key(cache_key) if cache_key else None
+        headers = image_headers(file_path, etag, post.get("created_at") if post else None)
+        range_header = requested_range(request.headers.get("range"), request.headers.get("if-range"), etag)
+
+        if etag and etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        if cache_key:
+            file_path_refresher.touch(cache_key)
+            cached = await image_cache.get(cache_key)
+            if cached:
+                # Like the fetch path below, point the client at the file's current path, not a stale alias
+                headers["X-File-Path"] = image_cache.current_path(cache_key, cached) or file_path
+                return cached_image_response(cached, headers, range_header, is_head)
+            if post is None:
+                post = await fetch_file_identity_once(file_path)
+                if post:
+                    headers = image_headers(file_path, etag, post.get("created_at"))
+
+        last_modified = post["created_at"].timestamp() if post and post.get("created_at") else None
+
+        # A previously issued path resolves to the file's current one: fetch that and tell the client
+        source_path = post["file_path"] if post and post.get("file_path") else file_path
+        headers["X-File-Path"] = source_path
+
         # Try to get image from current path
-        response = await get_image(file_path=file_path)
-        
-        if response["ok"]:
-            return Response(content=response["content"], media_type=response["media_type"], headers={"X-File-Path": file_path})
+        if is_head:
+            response = await head_image(source_path)
+            if response["ok"]:
+                if post:
+                    file_path_refresher.record_view(post, source_path)
+                return head_image_response(response, headers)
+        else:
+            response = await open_image_stream(file_path=source_path, range_header=range_header)
+            if response["ok"]:
+                if post:
+                    file_path_refresher.record_view(post, source_path)
+                    response = cache_image_stream(response, cache_key, last_modified, source_path)
+                return image_response(response, headers)
         
-        # If image not found, fetch from DB and update
-        pipeline = [
-            {
-                "$match": {
-                    "$or": [
-                        {"file_details.high.file_path": file_path},
-                        {"file_details.medium.file_path": file_path}
-                    ]
-                }
-            },
-            {
-                "$project": {
-                    "user_id": 1,
-                    "message_id": 1,
-                    "resolution": {
-                        "$cond": [
-                            {"$eq": ["$file_details.high.file_path", file_path]},
-                            "high",
-                            "medium"
-                        ]
-                    },
-                    "file_id": {
-                        "$cond": [
-                            {"$eq": ["$file_details.high.file_path", file_path]},
-                            "$file_details.high.file_id",
-                            "$file_details.medium.file_id"
-                        ]
-                    },
-                    "file_path": {
-                        "$cond": [
-                            {"$eq": ["$file_details.high.file_path", file_path]},
-                            "$file_details.high.file_path",
-                            "$file_details.medium.file_path"
-                        ]
-                    }
-                }
-            }
-        ]
-
-        posts = await (await posts_collection.aggregate(pipeline)).to_list(length=1)
-        if not posts:
+        # If image not found, refetch the path from telegram and update DB
+        if not post:
             raise HTTPException(status_code=404, detail="Post not found in database")
-        
-        post = posts[0]
-        file_id = post.get("file_id")
-        
-        # Get user's chat_id
-        user_doc = await users_collection.find_one(
-            {"user_id": post.get("user_id")},
-            {"chat_id": 1, "_id": 0}
-        )
-
-        if not user_doc:
-            raise HTTPException(status_code=404, detail="User not found")
 
-        chat_id = user_doc.get("chat_id")
-
-        # Get new file path
-        new_file_path = await get_file_path(
-            file_id,
-            message_id=post.get("message_id"),
-            chat_id=chat_id,
-            resolution=post.get("resolution"),
-            user_id=post.get("user_id")
-        )
+        # Concurrent misses for the same file share one refresh
+        new_file_path = await refresh_file_path_once(post)
+        if not new_file_path:
+            raise HTTPException(status_code=404, detail="Could not refresh file path")
+        headers["X-File-Path"] = new_file_path
 
         # Try to fetch image with new path
-        response = await get_image(file_path=new_file_path)
+        if is_head:
+            response = await head_image(new_file_path)
+        else:
+            response = await open_image_stream(file_path=new_file_path, range_header=range_header)
         
         if response["ok"]:
-            # Update the file path in database
-            await posts_collection.update_one(
-                {"_id": post["_id"]},
-                {"$set": {f"file_details.{post.get('resolution')}.file_path": new_file_path}}
-            )
-            return Response(content=response["content"], media_type=response["media_type"], headers={"X-File-Path": new_file_path})
+            file_path_refresher.record_view(post, new_file_path)
+            if is_head:
+                return head_image_response(response, headers)
+            return image_response(cache_image_stream(response, cache_key, last_modified, new_file_path), headers)
 
         raise HTTPException(status_code=404, detail="Image not found even after path refresh")
 
@@ -156,14 +237,26 @@ async def getImage(file_path: str = Query(...)):
 
     
 @app.get("/getUserPosts")
-async def get_user_posts(user_id: str = Query(...)):
+async def get_user_posts(
+    response: Response,
+    user_id: str = Query(...),
+    limit: int = Query(DEFAULT_PAGE_SIZE, description=f"Page size (at most {MAX_PAGE_SIZE})"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    view: str = Query("full", description="full, or grid for thumbnail fields only"),
+    stream: Optional[str] = Query(None, description="ndjson or array: stream every post after the cursor instead of one page")
+):
+    """The user's posts, newest first, one page at a time; X-Next-Cursor holds the next page's cursor."""
     try:
-        # method 1: Fetch posts directly
-        user_posts = await posts_collection.find({"user_id": user_id}).to_list(length=None)
+        if stream:
+            return streaming_response(stream_user_posts(user_id, cursor, view), stream)
+
+        user_posts, next_cursor = await list_user_posts(user_id, page_size(limit), cursor, view)
         
-        if not user_posts:
+        if not user_posts and not cursor:
             return {"ok":False, "message": "No posts found for this user."}
         
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         return [serialize_doc(post) for post in user_posts]
     
     except Exception as e:
@@ -172,15 +265,24 @@ async def get_user_posts(user_id: str = Query(...)):
 from bson import ObjectId
 
 @app.post("/getPostFromBoard")
-async def get_post_from_board(board_id: str = Body(..., embed=True)):
+async def get_post_from_board(
+    response: Response,
+    board_id: str = Body(..., embed=True),
+    limit: int = Body(DEFAULT_PAGE_SIZE, embed=True),
+    cursor: Optional[str] = Body(None, embed=True),
+    view: str = Body("full", embed=True)
+):
+    """A board's posts in board order, one page at a time; X-Next-Cursor holds the next page's cursor."""
     try:
-        board = await boards_collection.find_one({"_id": ObjectId(board_id)}, {"posts": 1, "user_id": 1, "_id": 0, "name": 1})
-        post_ids = board.get("posts", [])
-        user_posts = await posts_collection.find({"_id": {"$in": post_ids}}).to_list(length=None)
+        board, user_posts, next_cursor = await list_board_posts(board_id, page_size(limit), cursor, view)
+        if board is None:
+            return {"ok": False, "message": "Board not found"}
 
-        if not user_posts:
+        if not user_posts and not cursor:
             return {"ok":False, "message": "No posts found for this user."}
 
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         return {"posts":[serialize_doc(post) for post in user_posts], "board": board["name"]}
     except Exception as e:
         return {"ok": False, "message": str(e)}
@@ -188,26 +290,66 @@ async def get_post_from_board(board_id: str = Body(..., embed=True)):
 
 @app.get("/search")
 async def search_posts(
+    response: Response,
     query: str = Query(..., min_length=1, description="Search query"),
-    user_id: str = Query(..., description="User ID")
+    user_id: str = Query(..., description="User ID"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, description=f"Page size (at most {MAX_PAGE_SIZE})"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    mode: str = Query("auto", description="text, boolean, or auto (boolean when the query uses its syntax)"),
+    stream: Optional[str] = Query(None, description="ndjson or array: stream every result after the cursor instead of one page")
 ):
     """
     Search posts by tags.
     
     - **standard**: Text-based autocomplete with typo tolerance (FREE)
-    - **semantic**: AI-powered meaning-based search (PREMIUM)
+    - **semantic**: AI-powered meaning-based search, fused with the text matches (PREMIUM)
     
     Examples:
     - Standard: query="tira" finds "tiramisu"
     - Semantic: query="italian dessert" finds "tiramisu", "panna cotta", "gelato"
+    - Boolean: query='cat AND sofa -dog', '"ice cream" OR gelato' (exact tags, newest first)
+
+    Results are ordered by tag relevance within windows of the newest
+    SEARCH_MAX_CANDIDATES matching posts (newer windows first), so every match is
+    returned but no request scores more than one window at a time. Boolean results
+    are newest first. Results are paged; when more results exist the X-Next-Cursor
+    response header holds the cursor for the next page. With `stream`,
+    all remaining results are streamed as NDJSON lines or one JSON array instead.
     """
+    timer = StageTimer()
     try:
-        # Route to appropriate search method
-        user_premium = await is_premium_user(user_id)
-        if user_premium:
-            tags = await search_tags_semantic(query, user_id)
+        if mode == "boolean" or (mode == "auto" and looks_boolean(query)):
+            try:
+                parsed = parse_query(query)
+                if stream:
+                    return streaming_response(await stream_posts_boolean(user_id, parsed, cursor), stream)
+                search_results, next_cursor = await timer.measure(
+                    "boolean", search_posts_boolean(user_id, parsed, page_size(limit), cursor)
+                )
+            except (QuerySyntaxError, InvalidCursor) as e:
+                return {"ok": False, "message": str(e), "query": query}
+            if not search_results and not cursor:
+                return {"ok": False, "message": "No posts found matching the query.", "query": query}
+            if next_cursor:
+                response.headers["X-Next-Cursor"] = next_cursor
+            response.headers["Server-Timing"] = timer.server_timing()
+            return search_results
+
+        # Lexical search starts right away and overlaps the membership lookup; premium
+        # users additionally get semantic retrieval, fused with the lexical results
+        lexical = asyncio.ensure_future(timer.measure("lexical", search_tags_standard(query, user_id)))
+        try:
+            user_premium = await timer.measure("membership", is_premium_user(user_id))
+        except BaseException:
+            lexical.cancel()
+            raise
+        if user_premium and SEARCH_RANKING == "hybrid":
+            tags = await search_tags_hybrid(query, user_id, lexical=lexical, timer=timer)
+        elif user_premium:
+            lexical.cancel()
+            tags = await timer.measure("semantic", search_tags_semantic(query, user_id))
         else:
-            tags = await search_tags_standard(query, user_id)
+            tags = await lexical
         
         if not tags:
             return {
@@ -219,22 +361,18 @@ async def search_posts(
         tag_names = [t["name"] for t in tags]
         print(f"Premium User?: {user_premium}, Query: {query}, Found tags: {tag_names}")
         
-        # Find posts with matching tags
-        search_results = await posts_collection.find(
-            {
-                "tag_names": {"$in": tag_names},
-                "user_id": user_id
-            },
-            {
-                "file_details": 1,
-                "caption": 1,
-                "tag_names": 1,
-                "created_at": 1,
-                "_id": 0
-            }
-        ).to_list(length=None)
+        try:
+            if stream:
+                return streaming_response(
+                    stream_posts_by_tags(user_id, tags, cursor), stream, {"Server-Timing": timer.server_timing()}
+                )
+            search_results, next_cursor = await timer.measure(
+                "posts", search_posts_by_tags(user_id, tags, page_size(limit), cursor)
+            )
+        except InvalidCursor as e:
+            return {"ok": False, "message": str(e)}
         
-        if not search_results:
+        if not search_results and not cursor:
             return {
                 "ok": False,
                 "message": "No posts found matching the query.",
@@ -242,18 +380,43 @@ async def search_posts(
                 "tags_found": tag_names,
             }
         
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Server-Timing"] = timer.server_timing()
         return search_results
     except Exception as e:
         print(f"Search error: {e}")
         return {"ok": False, "message": str(e)}
+    finally:
+        search_latency.record(timer)
 
 
-
+@app.get("/metrics")
+async def metrics():
+    """Runtime counters for caches and outbound clients."""
+    return {
+        "update_queue": update_queue.stats(),
+        "image_cache": image_cache.stats(),
+        "telegram": telegram_client.metrics(),
+        "gemini": gemini_metrics(),
+        "tag_cache": tag_result_cache.stats(),
+        "tag_vocabulary": tag_vocabulary_cache.stats(),
+        "embeddings": {**embedding_engine.stats(), "cache": embedding_cache.stats()},
+        "vector_index": local_vector_search.stats(),
+        "tag_index": local_tag_search.stats(),
+        "post_index": post_tag_index.stats(),
+        "search_latency": search_latency.stats(),
+        "auth_cache": init_data_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "file_paths": file_path_index.stats(),
+        "counter_reconciler": counter_reconciler.stats(),
+        "path_refresh": {**file_path_refresher.stats(), "single_flight": path_refresh_flight.stats(), "identity_single_flight": identity_flight.stats()},
+    }
 
 @app.get('/getFilePaths')
-def getFilePaths(user_id: str = Query(...)):
+async def getFilePaths(user_id: str = Query(...)):
     fetcher = TelegramFilePathFetcher(BOT_API,user_id)
-    return asyncio.run(fetcher.process())
+    return await fetcher.process()
 
 @app.get('/get_user_from_db')
 def get_user_from_db():
@@ -320,7 +483,7 @@ async def process_update(update: dict):
         elif message.get("photo"):
             message_id = str(message.get("message_id"))
             
-            if await users_collection.find_one({"user_id": user_id}) is None:
+            if await user_cache.get(user_id) is None:
                 await handle_new_user(user, chat_id)
                 
             file_details = await extract_photo_details(message["photo"])
@@ -328,16 +491,35 @@ async def process_update(update: dict):
             post_id = await save_post(user_id, message_id, message.get("caption", ""), file_details, chat_id=chat_id)
 
             # fetch the photo byte from post file
-            response = requests.get(os.getenv("TELE_FILE_URL") + (file_details.medium or file_details.high).file_path)
-            base64_bytes = base64.b64encode(response.content).decode("utf-8")
-            mime_type = fetch_mime_type(str(base64_bytes),file_details.high.file_path)
+            preview_resolution = "medium" if file_details.medium else "high"
+            preview = getattr(file_details, preview_resolution)
+            image = await get_image(preview.file_path)
+            if not image["ok"]:
+                raise Exception(f"Failed to download photo: {image.get('error')}")
+            base64_bytes = base64.b64encode(image["content"]).decode("utf-8")
+            mime_type = image["media_type"]
+            # Warm the image cache: the gallery will ask for this preview next
+            await image_cache.put(image_cache_key(preview.file_unique_id, post_id, preview_resolution), image["content"], mime_type, datetime.now().timestamp(), preview.file_path)
             await send_msg(text=f"Read: {mime_type}", chat_id=chat_id, error=False)
-            post_count = await posts_collection.count_documents({"user_id":user_id})
-            user_doc = await users_collection.find_one({"user_id": user_id})
-            membership = user_doc.get("membership", {})
+            # O(1): stats.posts is maintained by save_post/deletePost (and already includes this post)
+            profile = await user_cache.get(user_id)
+            post_count = profile.post_count if profile else 0
             # Check if the user has an active paid plan or is within free period limit
-            if post_count <= 50 or (membership.get("expires_at") and membership.get("expires_at") > datetime.now()):
-                tags_list = await generate_tags(mime_type=mime_type, data=base64_bytes, user_id=user_id)
+            if post_count <= 50 or (profile and profile.is_premium):
+                # Reuse tags from an identical or near-identical image before asking Gemini
+                sha256, phash = content_hash(image["content"]), None
+                tags_list = await tag_result_cache.lookup_exact(user_id, preview.file_unique_id, sha256)
+                if tags_list is None:
+                    phash = await perceptual_hash(image["content"])
+                    tags_list = await tag_result_cache.lookup_similar(user_id, preview.file_unique_id, sha256, phash)
+                if tags_list is None:
+                    try:
+                        tags_list = await generate_tags(mime_type=mime_type, data=base64_bytes, user_id=user_id, caption=message.get("caption", ""))
+                    except CircuitOpen:
+                        # Gemini is degraded: keep the post, skip tagging instead of queueing more doomed calls
+                        await send_msg(text="Tagging is temporarily unavailable, your post was saved without tags", chat_id=chat_id, error=False)
+                        return
+                    await tag_result_cache.store(user_id, preview.file_unique_id, sha256, phash, tags_list)
                 done = await save_tags_and_update_post(tags_list, user_id, post_id)
                 if done:
                     await send_msg(text=f"Tags {tags_list} added to post {post_id}", chat_id=chat_id, error=False)
@@ -350,6 +532,9 @@ async def process_update(update: dict):
         await send_msg(text=str(e), chat_id=chat_id)
         print(f"Webhook processing failed: {e}", flush=True)
 
+# Set here too, not only in the lifespan, so updates can be handled when no lifespan runs
+update_queue.set_handler(process_update)
+
 @app.delete("/deletePost")
 async def delete_post(file_path: str = Query(...)):
     """
@@ -381,6 +566,14 @@ async def delete_post(file_path: str = Query(...)):
         
         if delete_res.deleted_count == 0:
             return {"ok": False, "message": "Failed to delete post"}
+        await file_path_index.forget_post(post_id)
+        stats = await increment(post.get("user_id"), posts=-1, tagged_posts=-1 if post.get("tag_names") else 0)
+        if stats:
+            user_cache.set_post_count(post.get("user_id"), stats["posts"])
+        version = (stats or {}).get("version")
+        tag_vocabulary_cache.tags_removed(post.get("user_id"), post.get("tag_names") or [], version)
+        post_tag_index.post_deleted(post.get("user_id"), post_id, version)
+        user_written(post.get("user_id"), version)
         
         # 4. Optional: Delete associated tags if no other posts reference them
         # if post.get('tag_names'):
@@ -427,12 +620,9 @@ async def add_tag(name: str = Body(..., embed=True), file_path: str = Body(...,
 @app.post("/createBoard")
 async def create_board(name: str = Body(..., embed=True), user_id: str = Body(..., embed=True), file_paths: list = Body(..., embed=True)):
     try:
-        post_ids = []
-        for fp in file_paths:
-            post = await fetch_post_from_file_path(fp)
-            if not post.get("ok"):
-                return {"ok": False, "message": f"Post Not Found for file_path: {fp}"}
-            post_ids.append(post.get("post", {}).get("_id"))
+        post_ids, missing = await resolve_post_ids(file_paths)
+        if missing:
+            return {"ok": False, "message": f"Post Not Found for file_paths: {', '.join(missing)}", "missing": missing}
         
         # Create new board structure
         new_board = {
@@ -453,24 +643,19 @@ async def create_board(name: str = Body(..., embed=True), user_id: str = Body(..
         return {"ok": False, "message": f"Error: {str(e)}"}
     
 @app.get("/getUserBoards")
-async def get_user_boards(request: Request):
+async def get_user_boards(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, description=f"Page size (at most {MAX_PAGE_SIZE}); all boards when omitted"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page")
+):
     try:
         user_id = str(request.state.user["user"].get("id"))
-        user_boards = await boards_collection.find({"user_id": user_id}).to_list(length=None)
-        print(user_boards)
-        preview_imgs = []
-        for board in user_boards:
-            for post_id in board.get("posts", []):
-                if len(preview_imgs) >= 1:
-                    break
-                print(post_id)
-                post = await posts_collection.find_one({"_id": post_id})
-                preview_imgs.append(post["file_details"].get("medium").get("file_path") or post["file_details"].get("high").get("file_path"))
-            board["preview_images"] = preview_imgs
-            board["posts"] = [str(post_id) for post_id in board["posts"]]
-            preview_imgs = []
-        
-        return [serialize_doc(board) for board in user_boards]
+        size = page_size(limit) if limit or cursor else None
+        boards, next_cursor = await list_user_boards(user_id, size, cursor)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return boards
     
     except Exception as e:
         return {"ok": False, "message": str(e)}
@@ -496,19 +681,48 @@ async def rename_board(board_id: str = Body(..., embed=True), name: str = Body(.
         return {"ok": False, "message": f"Error: {str(e)}"}
     
 @app.put("/updateBoardPosts")
-async def update_board_posts(board_id: str = Body(..., embed=True), file_paths: list = Body(..., embed=True)):
+async def update_board_posts(
+    board_id: str = Body(..., embed=True),
+    file_paths: Optional[list] = Body(None, embed=True),
+    add_file_paths: list = Body([], embed=True),
+    remove_file_paths: list = Body([], embed=True)
+):
+    """
+    Replace a board's posts with `file_paths`, or, when `file_paths` is omitted,
+    apply an incremental edit: add `add_file_paths` and remove `remove_file_paths`.
+    """
     try:
-        post_ids = []
-        for fp in file_paths:
-            post = await fetch_post_from_file_path(fp)
-            if not post.get("ok"):
-                return {"ok": False, "message": f"Post Not Found for file_path: {fp}"}
-            post_ids.append(post.get("post", {}).get("_id"))
-        
-        update_res = await boards_collection.update_one({"_id": ObjectId(board_id)}, {"$set": {"posts": post_ids}})
-        if update_res.modified_count == 0:
-            return {"ok": False, "message": "Failed to update board posts or no changes made"}
-        return {"ok": True, "message": "Board posts updated successfully"}
+        if file_paths is not None:
+            post_ids, missing = await resolve_post_ids(file_paths)
+            if missing:
+                return {"ok": False, "message": f"Post Not Found for file_paths: {', '.join(missing)}", "missing": missing}
+            update_res = await boards_collection.update_one({"_id": ObjectId(board_id)}, {"$set": {"posts": post_ids}})
+            if update_res.modified_count == 0:
+                return {"ok": False, "message": "Failed to update board posts or no changes made"}
+            return {"ok": True, "message": "Board posts updated successfully"}
+
+        (add_ids, missing_add), (remove_ids, missing_remove) = await asyncio.gather(
+            resolve_post_ids(add_file_paths), resolve_post_ids(remove_file_paths)
+        )
+        if missing_add:
+            return {"ok": False, "message": f"Post Not Found for file_paths: {', '.join(missing_add)}", "missing": missing_add}
+        # $pull and $addToSet on the same array need separate updates; send them as one batch
+        operations = []
+        if remove_ids:
+            operations.append(UpdateOne({"_id": ObjectId(board_id)}, {"$pull": {"posts": {"$in": remove_ids}}}))
+        if add_ids:
+            operations.append(UpdateOne({"_id": ObjectId(board_id)}, {"$addToSet": {"posts": {"$each": add_ids}}}))
+        if not operations:
+            return {"ok": False, "message": "No changes requested"}
+        update_res = await boards_collection.bulk_write(operations, ordered=True)
+        if update_res.matched_count == 0:
+            return {"ok": False, "message": "Board not found"}
+        return {
+            "ok": True,
+            "message": "Board posts updated successfully",
+            "modified": update_res.modified_count > 0,
+            "missing": missing_remove,
+        }
     except Exception as e:
         return {"ok": False, "message": f"Error: {str(e)}"}
     
@@ -640,15 +854,14 @@ async def create_invoice(request: Request, invoice: InvoiceRequest):
 @app.get("/check-membership")
 async def check_membership(request: Request):
     user_id = request.state.user["user"].get("id")
-    user_doc = await users_collection.find_one({"user_id": str(user_id)})
-    if not user_doc:
+    profile = await user_cache.get(user_id)
+    if not profile:
         return {"ok": False, "message": "User not found"}
 
-    current_membership = user_doc.get("membership", {})
+    current_membership = profile.membership
     if not current_membership:
         return {"ok": True, "isFree": True, "message": "No membership found"}
-    isPaid = current_membership.get("expires_at") and current_membership.get("expires_at") > datetime.now()
-    if not isPaid:
+    if not profile.is_premium:
         return {"ok": True, "isFree": True, "message": "No active membership found"}
 
     return {"ok": True, "membership": current_membership}
\ No newline at end of file
@@ -36,6 +36,7 @@ class MongoBaseModel(BaseModel):
 class FileDetails(MongoBaseModel):
     file_id: str
     file_path: str
+    file_unique_id: Optional[str] = None
 
 
 # Wrapper for resolution-based file details
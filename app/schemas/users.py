@@ -45,6 +45,11 @@ class PaymentRecord(BaseModel):
     title: str
     telegram_payment_charge_id: Optional[str] = None 
 
+class UserStats(MongoBaseModel):
+    posts: int = 0
+    tagged_posts: int = 0
+    tags: int = 0
+
 class User(MongoBaseModel):
     user_id: str
     first_name: str
@@ -53,7 +58,7 @@ class User(MongoBaseModel):
     last_name: str | None = None
     profile_image_id: str | None = None
     profile_image_path: str | None = None
-    posts: List[ObjectId] = []
+    stats: UserStats = Field(default_factory=UserStats)
     created_at: datetime = Field(default_factory=lambda: datetime.now())
     membership: Membership = Field(default_factory=Membership)
 
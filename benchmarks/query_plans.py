@@ -0,0 +1,37 @@
+"""
+Check that every hot query is served by an index.
+
+Creates the registry indexes (unless --no-create), explains each query in
+app.actions.indexes.HOT_QUERIES and exits non-zero if any winning plan
+contains a COLLSCAN.
+
+Usage:
+    python -m benchmarks.query_plans [--no-create]
+"""
+import argparse, asyncio, sys
+from app.actions.indexes import ensure_indexes, missing_indexes, verify_query_plans
+
+
+async def main(create: bool) -> int:
+    if create:
+        await ensure_indexes()
+    missing = await missing_indexes()
+    for collection, names in missing.items():
+        print(f"missing  {collection}: {', '.join(names)}")
+
+    results = await verify_query_plans()
+    for result in results:
+        print(f"{'ok  ' if result['ok'] else 'SCAN'}  {result['name']:<22} {' > '.join(result['stages'])}")
+    failed = [r["name"] for r in results if not r["ok"]]
+    if failed or missing:
+        print(f"\n{len(failed)} queries scan a collection, {sum(len(n) for n in missing.values())} indexes missing")
+        return 1
+    print(f"\nAll {len(results)} hot queries use an index")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--no-create", action="store_true", help="only check, do not create missing indexes")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(not args.no_create)))
@@ -0,0 +1,55 @@
+"""
+Compare semantic tag search latency: Atlas $vectorSearch vs the in-process vector index.
+
+Usage:
+    python -m benchmarks.vector_search <user_id> "query one" "query two" ... [--runs 20]
+"""
+import argparse, asyncio, statistics, time
+from app.actions.embeddings import generate_embeddings_async
+from app.actions.telegram_bot import search_tags_atlas_vector
+from app.actions.vector_index import local_vector_search
+
+
+async def timed(fn, runs: int) -> list[float]:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summary(samples: list[float]) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"p50={statistics.median(ordered):.2f}ms p95={p95:.2f}ms mean={statistics.fmean(ordered):.2f}ms"
+
+
+async def main(user_id: str, queries: list[str], runs: int, limit: int):
+    started = time.perf_counter()
+    index = await local_vector_search.get(user_id)
+    print(f"Loaded local index for {user_id}: {len(index)} tags in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    for query in queries:
+        embedding = (await generate_embeddings_async([query]))[0]
+        local = await local_vector_search.search(user_id, embedding, limit)
+        print(f"\nQuery: {query!r}")
+        print(f"  local : {summary(await timed(lambda: local_vector_search.search(user_id, embedding, limit), runs))}")
+        try:
+            atlas = await search_tags_atlas_vector(embedding.tolist(), user_id, limit)
+            print(f"  atlas : {summary(await timed(lambda: search_tags_atlas_vector(embedding.tolist(), user_id, limit), runs))}")
+            overlap = len({t['name'] for t in local} & {t['name'] for t in atlas})
+            print(f"  top-{limit} overlap: {overlap}/{max(len(atlas), 1)}")
+        except Exception as e:
+            print(f"  atlas : unavailable ({e})")
+        print(f"  local top: {[t['name'] for t in local]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("user_id")
+    parser.add_argument("queries", nargs="+")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.user_id, args.queries, args.runs, args.limit))